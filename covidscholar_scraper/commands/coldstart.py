@@ -0,0 +1,67 @@
+import statistics
+import subprocess
+import sys
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+# Run in a fresh interpreter: everything "scrapy crawl <spider>" does before
+# the first request, and the number of modules that it imported.
+_COLD_START = '''
+import sys
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+
+process = CrawlerProcess(get_project_settings(), install_root_handler=False)
+crawler = process.create_crawler(sys.argv[1])
+print(len(sys.modules))
+'''
+
+
+class Command(ScrapyCommand):
+    requires_project = True
+    default_settings = {'LOG_ENABLED': False}
+
+    def syntax(self):
+        return '[options] [spider ...]'
+
+    def short_desc(self):
+        return 'Measure the cold start time of spiders'
+
+    def long_desc(self):
+        return ('Start a new interpreter for every spider (default: all of them), load the '
+                'project and the spider like "scrapy crawl" does, and report the median time.')
+
+    def add_options(self, parser):
+        super(Command, self).add_options(parser)
+        # argparse in newer scrapy versions, optparse in older ones.
+        add = getattr(parser, 'add_argument', None) or parser.add_option
+        add('--repeat', dest='repeat', type=int, default=3, help='runs per spider (default: 3)')
+
+    def run(self, args, opts):
+        spiders = args or sorted(self.crawler_process.spider_loader.list())
+        if opts.repeat < 1:
+            raise UsageError('--repeat must be at least 1')
+
+        print(f'{"spider":<28} {"median (s)":>10} {"min (s)":>8} {"modules":>8}')
+        results = []
+        for name in spiders:
+            times = []
+            modules = None
+            for _ in range(opts.repeat):
+                started = time.perf_counter()
+                proc = subprocess.run(
+                    [sys.executable, '-c', _COLD_START, name],
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                times.append(time.perf_counter() - started)
+                if proc.returncode:
+                    print(f'{name}: failed to start\n{proc.stderr}', file=sys.stderr)
+                    break
+                modules = int(proc.stdout.split()[-1])
+            else:
+                results.append((statistics.median(times), min(times), name, modules))
+                print(f'{name:<28} {statistics.median(times):>10.2f} {min(times):>8.2f} {modules:>8}')
+
+        if len(results) > 1:
+            print(f'Total median cold start of {len(results)} spiders: {sum(x[0] for x in results):.2f} s')
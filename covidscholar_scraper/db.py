@@ -0,0 +1,433 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+import bson
+import gridfs
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, ConnectionFailure, DocumentTooLarge, DuplicateKeyError
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_mongo_client(settings) -> MongoClient:
+    """
+    Returns the process-wide MongoClient for the MONGO_* settings.
+
+    The client keeps a connection pool of MONGO_MAX_POOL_SIZE connections and
+    authenticates each connection once when it is opened, so all spiders
+    and helpers in a process share connections instead of reconnecting.
+    A forked child gets a new client, since pymongo clients are not fork-safe.
+    """
+    compressors = settings.get('MONGO_COMPRESSORS') or None
+    if isinstance(compressors, (list, tuple)):
+        compressors = ','.join(compressors)
+
+    options = {
+        'host': settings['MONGO_HOSTNAME'],
+        'username': settings['MONGO_USERNAME'],
+        'password': settings['MONGO_PASSWORD'],
+        'authSource': settings['MONGO_AUTHENTICATION_DB'],
+        'maxPoolSize': int(settings.get('MONGO_MAX_POOL_SIZE') or 100),
+        'compressors': compressors,
+        'socketTimeoutMS': settings.get('MONGO_SOCKET_TIMEOUT_MS') or None,
+        'connectTimeoutMS': settings.get('MONGO_CONNECT_TIMEOUT_MS') or 20000,
+        'serverSelectionTimeoutMS': settings.get('MONGO_SERVER_SELECTION_TIMEOUT_MS') or 30000,
+    }
+    options = {k: v for k, v in options.items() if v is not None}
+    key = (os.getpid(),) + tuple(sorted((k, str(v)) for k, v in options.items()))
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = MongoClient(**options)
+        return client
+
+
+def get_database(settings) -> Database:
+    """Returns the MONGO_DB database of :func:`get_mongo_client`."""
+    return get_mongo_client(settings)[settings['MONGO_DB']]
+
+
+def get_metadata_collection(settings, db: Database = None) -> Collection:
+    """Returns the MONGO_METADATA_COLLECTION collection, which holds the scraper's own bookkeeping."""
+    if db is None:
+        db = get_database(settings)
+    return db[settings.get('MONGO_METADATA_COLLECTION') or 'Scraper_metadata']
+
+
+def get_index_registry(settings, db: Database = None) -> 'IndexRegistry':
+    return IndexRegistry(get_metadata_collection(settings, db))
+
+
+def get_pdf_content_index(settings, db: Database = None) -> 'PDFContentIndex':
+    if db is None:
+        db = get_database(settings)
+    collection = db[settings.get('PDF_CONTENT_COLLECTION') or 'Scraper_pdf_content']
+    get_index_registry(settings, db).ensure(collection, [
+        ([('sha256', ASCENDING), ('params', ASCENDING)], {'unique': True}),
+    ])
+    return PDFContentIndex(collection)
+
+
+def normalize_index_spec(index) -> dict:
+    """
+    Normalize an index as declared in ``collections_config`` into a dict
+    with the "keys" as a list of [field, direction] pairs, plus any
+    create_index options. An index is a field name, a list of
+    (field, direction) pairs, or a tuple of either and a dict of options,
+    e.g. ``([('sha256', ASCENDING)], {'unique': True})``.
+    """
+    options = {}
+    if isinstance(index, tuple):
+        if len(index) > 1:
+            options = dict(index[1])
+        index = index[0]
+    if isinstance(index, str):
+        keys = [[index, ASCENDING]]
+    else:
+        keys = [[field, direction] for field, direction in index]
+    return dict(options, keys=keys)
+
+
+class IndexRegistry(object):
+    """
+    Records in a metadata collection which indexes were ensured on each
+    collection, so that create_index only runs for specs that are not in the
+    record yet. Several callers may ensure different indexes on the same
+    collection, e.g. spiders and the PDF worker on a GridFS bucket; the
+    record keeps all of them. Delete the "indexes:<collection>" record to
+    have them ensured again.
+
+    :param metadata: The metadata collection.
+    """
+
+    def __init__(self, metadata: Collection, logger=None):
+        self.metadata = metadata
+        self.logger = logger or logging.getLogger(__name__)
+
+    def ensure(self, collection: Collection, indices: list):
+        """
+        Create the indexes of ``collection`` that are not in the registry yet.
+
+        :param collection: The collection.
+        :param indices: Indexes as declared in ``collections_config``.
+        :return: Number of indexes created.
+        """
+        specs = [normalize_index_spec(x) for x in indices]
+        key = 'indexes:' + collection.full_name
+        record = self.metadata.find_one({'_id': key}) or {}
+        ensured = record.get('specs', [])
+
+        missing = [x for x in specs if x not in ensured]
+        if not missing:
+            return 0
+
+        for spec in missing:
+            self.logger.info('Creating index %r on %s', spec, collection.full_name)
+            options = spec.copy()
+            keys = [tuple(x) for x in options.pop('keys')]
+            collection.create_index(keys, background=True, **options)
+
+        self.metadata.update_one(
+            {'_id': key},
+            {'$push': {'specs': {'$each': missing}}, '$set': {'updated': datetime.now()}},
+            upsert=True)
+        return len(missing)
+
+
+def sha256_digest(data: bytes, chunk_size=1024 * 1024) -> str:
+    """Hex SHA-256 of ``data``, hashed in chunks without copying it."""
+    digest = hashlib.sha256()
+    view = memoryview(data)
+    for i in range(0, len(view), chunk_size):
+        digest.update(view[i:i + chunk_size])
+    return digest.hexdigest()
+
+
+def read_gridfs_file(db: Database, bucket, file_id) -> bytes:
+    """
+    Read a file stored by BaseSpider.save_pdf(). Files that reference the
+    content of a file in another bucket (see PDF_CONTENT_REFERENCES) are
+    followed to it.
+    """
+    grid_out = gridfs.GridFS(db, collection=bucket).get(file_id)
+    content_bucket = getattr(grid_out, 'content_bucket', None)
+    if content_bucket is not None:
+        return read_gridfs_file(db, content_bucket, grid_out.content_file_id)
+    return grid_out.read()
+
+
+class PDFContentIndex(object):
+    """
+    Maps the SHA-256 of PDF contents, together with the extractor version
+    (pdf_extractor.EXTRACTOR_VERSION), laparams and page/byte budget it was
+    extracted with, to the GridFS file that holds the content and its
+    extraction, across all buckets. The pdf_parser_version of spiders is
+    only a label per spider, so it is not part of the key.
+
+    :param collection: The collection that holds the mapping.
+    """
+
+    FIELDS = ('pdf_extraction_status', 'pdf_extraction_success', 'pdf_extraction_plist',
+              'pdf_extraction_exec', 'pdf_extractor_version', 'parsed_date', 'pdf_laparams',
+              'pdf_extraction_pages', 'pdf_extraction_truncated', 'pdf_max_pages', 'pdf_max_bytes')
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    @staticmethod
+    def params_key(extractor_version, laparams, max_pages=None, max_bytes=None) -> str:
+        params = [extractor_version, laparams]
+        if max_pages is not None or max_bytes is not None:
+            params.append({'max_pages': max_pages, 'max_bytes': max_bytes})
+        return json.dumps(params, sort_keys=True, default=str)
+
+    def find(self, sha256, extractor_version, laparams, max_pages=None, max_bytes=None) -> Optional[dict]:
+        """
+        Returns the .files document of an extracted file with this content
+        and parameters, with an added "bucket" field, or None.
+        """
+        entry = self.collection.find_one({
+            'sha256': sha256, 'params': self.params_key(extractor_version, laparams, max_pages, max_bytes)})
+        if entry is None:
+            return None
+
+        db = self.collection.database
+        files = db[entry['bucket'] + '.files'].find_one(
+            {'_id': entry['file_id']}, projection=('filename',) + self.FIELDS)
+        if files is None:
+            # The file was deleted.
+            self.collection.delete_one({'_id': entry['_id']})
+            return None
+        files['bucket'] = entry['bucket']
+        return files
+
+    def register(self, sha256, extractor_version, laparams, bucket, file_id, max_pages=None, max_bytes=None):
+        """Record that ``file_id`` in GridFS ``bucket`` holds this content, extracted with these parameters."""
+        try:
+            self.collection.insert_one({
+                'sha256': sha256,
+                'params': self.params_key(extractor_version, laparams, max_pages, max_bytes),
+                'bucket': bucket,
+                'file_id': file_id,
+                'created': datetime.now(),
+            })
+        except DuplicateKeyError:
+            # Another crawl extracted the same content at the same time.
+            pass
+
+
+def _is_duplicate_id_error(error: dict) -> bool:
+    """Whether a bulk write error is a duplicate key error on the _id index."""
+    if error.get('code') != 11000:
+        return False
+    key_pattern = error.get('keyPattern')
+    if key_pattern is not None:
+        return list(key_pattern) == ['_id']
+    # Servers before 4.2 only name the index in the message.
+    return ' index: _id_ ' in error.get('errmsg', '')
+
+
+class _WriteBuffer(object):
+    def __init__(self, collection: Collection):
+        self.collection = collection
+        self.documents = []
+        self.size = 0
+        self.since = None
+
+
+class BufferedWriter(object):
+    """
+    Collects documents per collection and writes them with unordered
+    bulk inserts.
+
+    A collection is flushed when it holds ``max_docs`` documents or
+    ``max_bytes`` of encoded BSON, or when its oldest pending document is
+    older than ``max_delay`` seconds. Documents are BSON-encoded once when
+    they are buffered, so oversized documents still raise
+    :class:`DocumentTooLarge` at the call site, just like ``insert_one``.
+    """
+
+    def __init__(self, max_docs=100, max_bytes=16 * 1024 * 1024, max_delay=5.0, logger=None):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.logger = logger or logging.getLogger(__name__)
+
+        self._buffers = {}
+        self._max_bson_size = None
+
+    def __len__(self):
+        return sum(len(x.documents) for x in self._buffers.values())
+
+    def insert(self, collection: Collection, document: dict) -> ObjectId:
+        """
+        Buffer a document for insertion.
+
+        :param collection: The collection to insert into.
+        :param document: The document. An ``_id`` is assigned if it has none.
+        :return: The ``_id`` of the document.
+        """
+        document.setdefault('_id', ObjectId())
+        raw = bson.encode(document, check_keys=True, codec_options=collection.codec_options)
+
+        if self._max_bson_size is None:
+            self._max_bson_size = collection.database.client.max_bson_size
+        if len(raw) > self._max_bson_size:
+            raise DocumentTooLarge(
+                'BSON document too large (%d bytes) - the connected server '
+                'supports BSON document sizes up to %d bytes.' % (len(raw), self._max_bson_size))
+
+        buffer = self._buffers.get(collection.full_name)
+        if buffer is None:
+            buffer = self._buffers[collection.full_name] = _WriteBuffer(collection)
+        if not buffer.documents:
+            buffer.since = time.monotonic()
+        buffer.documents.append(RawBSONDocument(raw))
+        buffer.size += len(raw)
+
+        if len(buffer.documents) >= self.max_docs or buffer.size >= self.max_bytes:
+            self._flush_buffer(buffer)
+        self.flush_expired()
+
+        return document['_id']
+
+    def flush_expired(self):
+        """Flush collections whose oldest pending document exceeded ``max_delay``."""
+        now = time.monotonic()
+        for buffer in list(self._buffers.values()):
+            if buffer.documents and now - buffer.since >= self.max_delay:
+                self._flush_buffer(buffer)
+
+    def flush(self, collection: Collection = None):
+        """
+        Write all pending documents.
+
+        :param collection: Only flush this collection. If None, flush all of them.
+        """
+        if collection is not None:
+            buffer = self._buffers.get(collection.full_name)
+            if buffer is not None:
+                self._flush_buffer(buffer)
+            return
+
+        for buffer in list(self._buffers.values()):
+            self._flush_buffer(buffer)
+
+    def _flush_buffer(self, buffer: _WriteBuffer):
+        documents = buffer.documents
+        if not documents:
+            return
+
+        buffer.documents = []
+        buffer.size = 0
+        buffer.since = None
+
+        try:
+            buffer.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Documents carry pre-assigned _ids, so a retried batch reports
+            # the already written ones as duplicate keys on _id. Violations of
+            # other unique indexes are real errors.
+            errors = [x for x in e.details.get('writeErrors', []) if not _is_duplicate_id_error(x)]
+            if errors:
+                self.logger.error('Failed to write %d of %d documents into %s: %r',
+                                  len(errors), len(documents), buffer.collection.full_name, errors[:5])
+        except ConnectionFailure:
+            # Keep the documents so that the next flush retries them.
+            buffer.documents = documents + buffer.documents
+            buffer.size = sum(len(x.raw) for x in buffer.documents)
+            buffer.since = time.monotonic()
+            raise
+        else:
+            self.logger.debug('Wrote %d documents into %s', len(documents), buffer.collection.full_name)
+
+
+class BloomFilter(object):
+    """
+    A fixed size Bloom filter over strings.
+
+    :param capacity: Number of values the filter is sized for.
+    :param error_rate: False positive rate at ``capacity`` values.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class DedupIndex(object):
+    """
+    In-process index over the values of one field of a collection, used to
+    answer duplicate checks without a round trip to the database.
+
+    Small collections are held in a set, which answers exactly. Collections
+    with more than ``bloom_threshold`` documents are held in a Bloom filter,
+    which only answers "absent" exactly; a hit has to be confirmed by a query.
+    """
+
+    def __init__(self, collection: Collection, key, bloom_threshold=1000000):
+        self.collection = collection
+        self.key = key
+        self.bloom_threshold = bloom_threshold
+        self.values = None
+
+    @property
+    def exact(self):
+        return isinstance(self.values, set)
+
+    def load(self):
+        """Load all values of the field with a projection-only cursor."""
+        count = self.collection.estimated_document_count()
+        if count > self.bloom_threshold:
+            # Leave room for the documents added during the crawl.
+            self.values = BloomFilter(capacity=count * 2)
+        else:
+            self.values = set()
+
+        cursor = self.collection.find(
+            {self.key: {'$exists': True}},
+            projection={self.key: 1, '_id': 0},
+            batch_size=10000)
+        for document in cursor:
+            self.add(document.get(self.key))
+
+    @staticmethod
+    def accepts(value):
+        """Whether lookups of this value can be answered by the index. Only strings are indexed."""
+        return isinstance(value, str)
+
+    def add(self, value):
+        if self.accepts(value):
+            self.values.add(value)
+
+    def __contains__(self, value):
+        return self.accepts(value) and value in self.values
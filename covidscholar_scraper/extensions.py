@@ -1,7 +1,66 @@
 import logging
 
 import sentry_sdk
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
 from sentry_sdk.integrations.logging import LoggingIntegration
+from twisted.internet import task
+
+# Stats keys counted by BaseSpider and summarized by SentryTelemetry.
+TELEMETRY_PREFIX = 'telemetry/'
+ARTICLES_SAVED = TELEMETRY_PREFIX + 'articles_saved'
+PDFS_STORED = TELEMETRY_PREFIX + 'pdfs_stored'
+PDFS_REUSED = TELEMETRY_PREFIX + 'pdfs_reused'
+PDF_BYTES = TELEMETRY_PREFIX + 'pdf_bytes'
+PDF_EXTRACTION_FAILURES = TELEMETRY_PREFIX + 'pdf_extraction_failures'
+NEW_VERSIONS = TELEMETRY_PREFIX + 'new_versions'
+
+
+def telemetry_counters(stats, spider) -> dict:
+    """The telemetry stats of a spider, without the prefix."""
+    return {
+        key[len(TELEMETRY_PREFIX):]: value
+        for key, value in stats.get_stats(spider).items()
+        if key.startswith(TELEMETRY_PREFIX)
+    }
+
+
+# The DSN that Sentry was initialized with in this process, and the names of
+# the spiders that are open in it.
+_sentry_dsn = None
+_open_spiders = set()
+
+
+def _tag_spider(event, hint):
+    # Events logged through a spider's logger are named after the spider.
+    if event.get('logger') in _open_spiders:
+        event.setdefault('tags', {}).setdefault('spider', event['logger'])
+    return event
+
+
+def init_sentry(dsn):
+    """
+    Initialize Sentry once per process. In "process" mode, concurrent
+    crawlers share the client, so events are tagged with their spider
+    instead of configuring the client per crawler.
+    """
+    global _sentry_dsn
+
+    if _sentry_dsn is not None:
+        if dsn != _sentry_dsn:
+            logging.getLogger(__name__).warning('Sentry is already initialized with another DSN, ignoring %s', dsn)
+        return
+
+    sentry_logging = LoggingIntegration(
+        level=logging.WARNING,
+        event_level=logging.ERROR,
+    )
+    sentry_sdk.init(
+        dsn=dsn,
+        integrations=[sentry_logging],
+        before_send=_tag_spider,
+    )
+    _sentry_dsn = dsn
 
 
 class SentryLogging(object):
@@ -11,13 +70,97 @@ class SentryLogging(object):
 
         dsn = crawler.settings['SENTRY_DSN']
         if dsn:
-            sentry_logging = LoggingIntegration(
-                level=logging.WARNING,
-                event_level=logging.ERROR,
-            )
-            sentry_sdk.init(
-                dsn=dsn,
-                integrations=[sentry_logging]
-            )
+            init_sentry(dsn)
+            crawler.signals.connect(ext.track_spider_opened, signal=signals.spider_opened)
+            crawler.signals.connect(ext.track_spider_closed, signal=signals.spider_closed)
+
+        return ext
+
+    def track_spider_opened(self, spider):
+        _open_spiders.add(spider.name)
+
+    def track_spider_closed(self, spider):
+        _open_spiders.discard(spider.name)
+
+
+class SentryTelemetry(SentryLogging):
+    """
+    Sends the per-spider telemetry counters (stats keys starting with
+    "telemetry/") to Sentry as one summary event every
+    SENTRY_SUMMARY_INTERVAL seconds and when the spider closes.
+    """
+
+    def __init__(self):
+        self.stats = None
+        self.interval = 0
+        self.enabled = False
+        self.tasks = {}
 
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = super(SentryTelemetry, cls).from_crawler(crawler)
+        ext.stats = crawler.stats
+        ext.interval = crawler.settings.getfloat('SENTRY_SUMMARY_INTERVAL', 600)
+        ext.enabled = bool(crawler.settings['SENTRY_DSN'])
+
+        if ext.enabled:
+            crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+            crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def counters(self, spider):
+        return telemetry_counters(self.stats, spider)
+
+    def send_summary(self, spider, message, **extra):
+        with sentry_sdk.push_scope() as scope:
+            scope.set_tag('spider', spider.name)
+            for key, value in self.counters(spider).items():
+                scope.set_extra(key, value)
+            for key, value in extra.items():
+                scope.set_extra(key, value)
+            sentry_sdk.capture_message(message)
+
+    def spider_opened(self, spider):
+        if self.interval > 0:
+            self.tasks[spider.name] = t = task.LoopingCall(
+                self.send_summary, spider, 'Scraper %s progress' % (spider.name,))
+            t.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        t = self.tasks.pop(spider.name, None)
+        if t is not None and t.running:
+            t.stop()
+
+        self.send_summary(spider, 'Scraper %s finished' % (spider.name,), reason=reason)
+        # Once per crawl, so that the summary is not lost when the process exits.
+        sentry_sdk.flush()
+
+
+class JobRunHistory(object):
+    """
+    Stores the telemetry counters of a crawl into its run record in the job
+    history, if the scheduler passed one in the JOB_RUN_ID setting.
+    """
+
+    def __init__(self, crawler, run_id):
+        self.crawler = crawler
+        self.run_id = run_id
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        run_id = crawler.settings.get('JOB_RUN_ID')
+        if not run_id:
+            raise NotConfigured
+
+        ext = cls(crawler, run_id)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
         return ext
+
+    def spider_closed(self, spider, reason):
+        from .job_history import get_job_history
+
+        counters = telemetry_counters(self.crawler.stats, spider)
+        try:
+            get_job_history(self.crawler.settings).set_counters(self.run_id, counters, reason)
+        except Exception:
+            spider.logger.exception('Cannot store counters in job history')
@@ -1,7 +1,7 @@
-import re
-
 from bs4 import Tag, Comment
 
+from ..normalization import collapse_spaces, newlines_to_spaces
+
 # Copy of https://raw.githubusercontent.com/CederGroupHub/LimeSoup/master/LimeSoup/parser/paragraphs.py
 
 __author__ = "Haoyan Huo"
@@ -30,7 +30,7 @@ NON_DISPLAY_TAGS = {
 
 
 def normalize_text(string):
-    return re.sub(r'[ \t]+', ' ', string.strip())
+    return collapse_spaces(string)
 
 
 def get_tag_text(cur_tag):
@@ -44,7 +44,7 @@ def get_tag_text(cur_tag):
     for child in cur_tag.contents:
         if child.name is None:
             # this is a pure text
-            strings.append(re.sub(r'\n', ' ', child))
+            strings.append(newlines_to_spaces(child))
         elif child.name in NON_DISPLAY_TAGS:
             pass
         elif child.name in LINEBREAK_ELEMENTS:
@@ -114,7 +114,7 @@ def extract_paragraphs_recursive(tag_or_soup, exclude_section_rules=None):
 
             if child.name is None:
                 # this is a pure text
-                child_text = re.sub(r'\n', ' ', child)
+                child_text = newlines_to_spaces(child)
                 if i < len(cur_tag.contents) - 1 and cur_tag.contents[i + 1].name is None:
                     # !!! This is actually a hack. When we modify the HTML DOM, we might
                     # remove a node between text nodes, thus these two nodes are left disconnected
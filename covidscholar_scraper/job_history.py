@@ -0,0 +1,78 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.collection import Collection
+
+from .db import get_database, get_index_registry, get_metadata_collection
+
+
+def get_job_history(settings) -> 'JobHistory':
+    db = get_database(settings)
+    collection = db[settings.get('JOB_HISTORY_COLLECTION') or 'Scraper_job_history']
+    get_index_registry(settings, db).ensure(collection, [
+        [('job', 1), ('start', -1)],
+    ])
+    return JobHistory(collection)
+
+
+class JobHistory(object):
+    """
+    One document per scheduled run: the job, start and end time, duration,
+    exit status, and the telemetry counters of the crawl (see
+    extensions.JobRunHistory), including the number of new items.
+    """
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def start(self, job, **extra) -> str:
+        """Record the start of a run. Returns the run id."""
+        run = dict(extra, job=job, start=datetime.now(), end=None, status=None)
+        return str(self.collection.insert_one(run).inserted_id)
+
+    def set_counters(self, run_id, counters: dict, finish_reason=None):
+        """Store the counters of the crawl, called by the crawl itself."""
+        new_items = sum(counters.get(x, 0) for x in ('articles_saved', 'new_versions'))
+        self.collection.update_one({'_id': ObjectId(run_id)}, {'$set': {
+            'counters': counters,
+            'new_items': new_items,
+            'finish_reason': finish_reason,
+        }})
+
+    def finish(self, run_id, status, **extra) -> dict:
+        """Record the end of a run. Returns the run document."""
+        end = datetime.now()
+        run = self.collection.find_one({'_id': ObjectId(run_id)}, projection=['start'])
+        update = dict(extra, end=end, status=status)
+        if run is not None:
+            update['duration'] = (end - run['start']).total_seconds()
+        return self.collection.find_one_and_update(
+            {'_id': ObjectId(run_id)}, {'$set': update}, return_document=ReturnDocument.AFTER)
+
+    def last_runs(self, job, limit=1) -> list:
+        return list(self.collection.find({'job': job}).sort('start', DESCENDING).limit(limit))
+
+
+def get_job_state(settings) -> 'JobState':
+    return JobState(get_metadata_collection(settings))
+
+
+class JobState(object):
+    """
+    The schedule of every job (its next and last run, and its current
+    interval) in the metadata collection, so that it survives restarts.
+    """
+
+    def __init__(self, collection: Collection):
+        self.collection = collection
+
+    def load(self) -> dict:
+        """Returns {job: state}."""
+        return {
+            x['_id'][len('job:'):]: x
+            for x in self.collection.find({'_id': {'$regex': '^job:'}})
+        }
+
+    def save(self, job, **fields):
+        self.collection.update_one({'_id': 'job:' + job}, {'$set': fields}, upsert=True)
@@ -0,0 +1,44 @@
+"""
+Text normalization shared by the PDF and HTML extractors.
+
+Every function does one pass over the text with a precompiled pattern or a
+str method, instead of filtering characters one at a time.
+"""
+import re
+import string
+
+_NON_PRINTABLE = re.compile('[^%s]+' % re.escape(string.printable))
+_NON_ASCII_LETTERS = re.compile('[^a-zA-Z]+')
+_WHITESPACE = re.compile(r'\s+')
+# Runs of spaces and tabs that are not already a single space.
+_SPACES = re.compile(r'[ \t]{2,}|\t')
+
+
+def only_printable(text):
+    """Remove the characters that are not in string.printable."""
+    return _NON_PRINTABLE.sub('', text)
+
+
+def collapse_whitespace(text):
+    """Replace runs of whitespace, including newlines, with a single space."""
+    return _WHITESPACE.sub(' ', text)
+
+
+def collapse_spaces(text):
+    """Strip text, and replace runs of spaces and tabs with a single space. Newlines are kept."""
+    return _SPACES.sub(' ', text.strip())
+
+
+def newlines_to_spaces(text):
+    """Replace every newline with a space."""
+    return text.replace('\n', ' ')
+
+
+def count_ascii_letters(text):
+    """Number of the characters in text that are ASCII letters."""
+    return len(_NON_ASCII_LETTERS.sub('', text))
+
+
+def is_mostly_letters(text):
+    """True if more than half of the printable, stripped text are ASCII letters."""
+    return count_ascii_letters(text) > 0.5 * len(only_printable(text).strip())
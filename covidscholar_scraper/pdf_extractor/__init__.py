@@ -1 +1,7 @@
-from . import paragraphs
+# pdfminer is slow to import, so the paragraphs module is only imported where
+# PDFs are parsed: import covidscholar_scraper.pdf_extractor.paragraphs explicitly.
+
+# Version of the extraction code. Extractions are reused across spiders (see
+# PDFContentIndex) only if they were made with the same version, so bump it
+# whenever a change to this package changes the extracted paragraphs.
+EXTRACTOR_VERSION = 'paragraphs_20261018'
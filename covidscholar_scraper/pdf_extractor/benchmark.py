@@ -0,0 +1,153 @@
+"""
+Speed comparisons of the PDF extraction steps:
+
+    python -m covidscholar_scraper.pdf_extractor.benchmark [--repeat N] file.pdf [...]
+"""
+import argparse
+import io
+import re
+import string
+import time
+
+from pdfminer.layout import LTLayoutContainer
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+from .. import normalization
+from . import paragraphs
+
+_PRINTABLE = set(string.printable)
+
+
+def record_textlines(pdf_data, laparams=None):
+    """Extract a PDF, and return the (container, laparams, lines) arguments of every group_textlines() call."""
+    calls = []
+
+    def recording(self, laparams, lines):
+        calls.append((self, laparams, list(lines)))
+        return paragraphs.group_textlines(self, laparams, lines)
+
+    LTLayoutContainer.group_textlines = recording
+    try:
+        paragraphs.extract_paragraphs_pdf(io.BytesIO(pdf_data), laparams=laparams)
+    finally:
+        LTLayoutContainer.group_textlines = paragraphs.group_textlines
+    return calls
+
+
+def time_calls(function, calls, repeat):
+    """Best time of running function over all recorded calls, and its last results."""
+    best = float('inf')
+    results = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        results = [function(*call) for call in calls]
+        best = min(best, time.perf_counter() - started)
+    return best, results
+
+
+def compare_group_textlines(pdf_data, repeat=5, laparams=None):
+    """
+    Compare group_textlines() with the Plane based group_textlines_plane().
+
+    :return: dict with the number of pages and lines, the best times of both
+        implementations in seconds, and whether they produced the same boxes.
+    """
+    calls = record_textlines(pdf_data, laparams=laparams)
+    plane_time, plane_boxes = time_calls(
+        lambda *call: list(paragraphs.group_textlines_plane(*call)), calls, repeat)
+    index_time, index_boxes = time_calls(
+        lambda *call: list(paragraphs.group_textlines(*call)), calls, repeat)
+
+    def signature(boxes):
+        return [[(box.bbox, [id(line) for line in box]) for box in page] for page in boxes]
+
+    return {
+        'pages': len(calls),
+        'lines': sum(len(lines) for _, _, lines in calls),
+        'plane': plane_time,
+        'index': index_time,
+        'same': signature(plane_boxes) == signature(index_boxes),
+    }
+
+
+def record_paragraph_texts(pdf_data, laparams=None):
+    """Extract a PDF, and return the raw text of every paragraph, before normalization."""
+    doc = PDFDocument(PDFParser(io.BytesIO(pdf_data)))
+    rsrcmgr = PDFResourceManager()
+    device = paragraphs.TextHandler(rsrcmgr, laparams=laparams)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    for page in PDFPage.create_pages(doc):
+        interpreter.process_page(page)
+    return [item['text'] for page in device.pages for item in page]
+
+
+def normalize_pdf_paragraph(text):
+    """The normalization of a PDF paragraph: None if it is dropped, else its final text."""
+    if not normalization.is_mostly_letters(text):
+        return None
+    return normalization.only_printable(normalization.collapse_whitespace(text)).strip()
+
+
+def normalize_pdf_paragraph_reference(text):
+    """normalize_pdf_paragraph() with the character filters and regular expressions used before."""
+    normalized_text = ''.join(filter(lambda k: k in _PRINTABLE, text)).strip()
+    if not len(re.findall(r'[a-zA-Z]', text)) > 0.5 * len(normalized_text):
+        return None
+    return ''.join(filter(lambda x: x in _PRINTABLE, re.sub(r'\s+', ' ', text))).strip()
+
+
+def normalize_html_text(text):
+    """The normalization of an HTML text node in html_extractor."""
+    return normalization.collapse_spaces(normalization.newlines_to_spaces(text))
+
+
+def normalize_html_text_reference(text):
+    """normalize_html_text() with the regular expressions used before."""
+    return re.sub(r'[ \t]+', ' ', re.sub(r'\n', ' ', text).strip())
+
+
+def compare_normalization(texts, repeat=5):
+    """
+    Compare the normalization functions with the reference implementations.
+
+    :return: {name: (reference seconds per text, seconds per text, same output)}.
+    """
+    results = {}
+    for name, function, reference in [
+            ('pdf', normalize_pdf_paragraph, normalize_pdf_paragraph_reference),
+            ('html', normalize_html_text, normalize_html_text_reference)]:
+        reference_time, reference_output = time_calls(reference, [(text,) for text in texts], repeat)
+        function_time, function_output = time_calls(function, [(text,) for text in texts], repeat)
+        count = max(len(texts), 1)
+        results[name] = (reference_time / count, function_time / count, reference_output == function_output)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the speed of the PDF extraction steps.')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per step, the best one counts (default: 5).')
+    parser.add_argument('files', nargs='+', metavar='PDF')
+    args = parser.parse_args()
+
+    for fn in args.files:
+        with open(fn, 'rb') as f:
+            pdf_data = f.read()
+        result = compare_group_textlines(pdf_data, repeat=args.repeat)
+        print(f'{fn}: {result["pages"]} pages, {result["lines"]} lines')
+        print(f'  group_textlines: Plane {result["plane"] * 1000:.1f} ms, '
+              f'TextLineIndex {result["index"] * 1000:.1f} ms '
+              f'({result["plane"] / result["index"]:.1f}x), '
+              f'{"same boxes" if result["same"] else "DIFFERENT BOXES"}')
+
+        texts = record_paragraph_texts(pdf_data)
+        for name, (reference, function, same) in compare_normalization(texts, repeat=args.repeat).items():
+            print(f'  {name} normalization of {len(texts)} paragraphs: before {reference * 1e6:.1f} us, '
+                  f'now {function * 1e6:.1f} us per paragraph ({reference / function:.1f}x), '
+                  f'{"same output" if same else "DIFFERENT OUTPUT"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,13 @@
-import os
+import hashlib
+import pickle
 import re
-import signal
-import string
 import sys
+import tempfile
 from collections import Counter
-from io import StringIO, BytesIO
-from multiprocessing import Process, Pipe
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 
+import numpy as np
 from pdfminer.converter import TextConverter
 from pdfminer.layout import LAParams, LTContainer, LTTextBox, LTLayoutContainer, LTTextLineHorizontal, \
     LTTextBoxHorizontal, LTTextBoxVertical
@@ -14,12 +15,21 @@ from pdfminer.pdfdocument import PDFDocument
 from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import PDFStream, resolve1
 from pdfminer.utils import Plane, uniq
 
+from .. import normalization
+from .pool import get_worker_pool
 
-def group_textlines(self, laparams, lines):
+# Pages streamed from workers are spooled in memory up to this many bytes,
+# and in a temporary file beyond.
+PAGE_SPOOL_MEMORY = 1024 * 1024
+
+
+def group_textlines_plane(self, laparams, lines):
     """Patched class method that fixes empty line aggregation, and allows
-    run-time line margin detection"""
+    run-time line margin detection. This is the reference implementation
+    that queries a pdfminer Plane, see group_textlines()."""
     plane = Plane(self.bbox)
     plane.extend(lines)
     boxes = {}
@@ -69,6 +79,158 @@ def group_textlines(self, laparams, lines):
     return
 
 
+class TextLineIndex(object):
+    """
+    Neighbor queries over the text lines of a page, answered for blocks of
+    lines at once from NumPy arrays of their bounding boxes. The results are
+    exactly the ones of LTTextLineHorizontal.find_neighbors() on a pdfminer
+    Plane, in the same order: Plane.find() visits the grid cells row by row
+    and each cell in insertion order, so a line is reported at the first cell
+    it shares with the query.
+    """
+
+    # Number of lines queried at once, which bounds the size of the relation matrices.
+    block_size = 128
+
+    def __init__(self, lines, bbox, gridsize=50):
+        """
+        :param lines: List of LTTextLineHorizontal.
+        :param bbox: Bounding box of the plane, the page or figure.
+        :param gridsize: Grid size of the pdfminer Plane.
+        """
+        self.bbox = bbox
+        self.gridsize = gridsize
+        self.x0, self.y0, self.x1, self.y1 = np.array(
+            [line.bbox for line in lines], dtype=np.float64).reshape(-1, 4).T
+        self.height = self.y1 - self.y0
+        self.blank = np.array([not line.get_text().strip() for line in lines], dtype=bool)
+
+        (px0, py0, px1, py1) = bbox
+        self.in_plane = self._in_plane(self.x0, self.y0, self.x1, self.y1)
+        self.cell_x0, self.cell_x1 = self._cells(np.maximum(px0, self.x0), np.minimum(px1, self.x1))
+        self.cell_y0, self.cell_y1 = self._cells(np.maximum(py0, self.y0), np.minimum(py1, self.y1))
+
+    def _in_plane(self, x0, y0, x1, y1):
+        (px0, py0, px1, py1) = self.bbox
+        return ~((x1 <= px0) | (px1 <= x0) | (y1 <= py0) | (py1 <= y0))
+
+    def _cells(self, v0, v1):
+        """Grid cell range [start, stop) of a clipped interval, see pdfminer.utils.drange()."""
+        return np.trunc(v0) // self.gridsize, np.trunc(v1 + self.gridsize) // self.gridsize
+
+    def blocks(self, rows):
+        """Split line indices into blocks of lines that are close vertically."""
+        rows = rows[np.argsort(self.y0[rows], kind='stable')]
+        return [rows[i:i + self.block_size] for i in range(0, len(rows), self.block_size)]
+
+    def relation(self, rows, ratios):
+        """
+        The neighbor relation of some lines.
+
+        :param rows: Indices of the queried lines.
+        :param ratios: Line margin of each queried line.
+        :return: (cols, mask, cell_x, cell_y). mask[r, c] is True if
+            lines[cols[c]] is a neighbor of lines[rows[r]], and (cell_x,
+            cell_y)[r, c] is the first grid cell where the Plane finds it.
+        """
+        d = (ratios * self.height[rows])[:, None]
+        (px0, py0, px1, py1) = self.bbox
+        qx0, qx1 = self.x0[rows][:, None], self.x1[rows][:, None]
+        qy0, qy1 = self.y0[rows][:, None] - d, self.y1[rows][:, None] + d
+        qcx0, qcx1 = self._cells(np.maximum(px0, qx0), np.minimum(px1, qx1))
+        qcy0, qcy1 = self._cells(np.maximum(py0, qy0), np.minimum(py1, qy1))
+
+        cols = np.flatnonzero(self.in_plane & (self.y0 < qy1.max()) & (qy0.min() < self.y1))
+        x0, y0, x1, y1 = self.x0[cols], self.y0[cols], self.x1[cols], self.y1[cols]
+        cell_x = np.maximum(self.cell_x0[cols], qcx0)
+        cell_y = np.maximum(self.cell_y0[cols], qcy0)
+        mask = (self._in_plane(qx0, qy0, qx1, qy1) &
+                (cell_x < np.minimum(self.cell_x1[cols], qcx1)) &
+                (cell_y < np.minimum(self.cell_y1[cols], qcy1)) &
+                (x0 < qx1) & (qx0 < x1) & (y0 < qy1) & (qy0 < y1) &
+                (np.abs(self.height[cols] - self.height[rows][:, None]) < d) &
+                ((np.abs(x0 - qx0) < d) | (np.abs(x1 - qx1) < d)))
+        return cols, mask, cell_x, cell_y
+
+    def paragraph_margins(self, rows, line_margin):
+        """
+        The run-time line margins of some lines: line_margin, reduced to the
+        distance to the closest neighbor at line_margin.
+
+        :return: (margins, found). found is False for the lines that are not
+            their own neighbor at line_margin.
+        """
+        cols, mask, _, _ = self.relation(rows, np.full(len(rows), line_margin))
+        is_self = cols == rows[:, None]
+        found = (mask & is_self).any(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            margins = np.minimum(
+                np.abs(self.y0[cols] - self.y1[rows][:, None]),
+                np.abs(self.y1[cols] - self.y0[rows][:, None])) * 1.05 / self.height[rows][:, None]
+        margins = np.where(mask & ~is_self, margins, np.inf)
+        if not len(cols):
+            return np.full(len(rows), line_margin), found
+        return np.minimum(line_margin, margins.min(axis=1)), found
+
+    def neighbors(self, rows, ratios, skip_blank=False):
+        """
+        Neighbors of some lines, the same as lines[i].find_neighbors(plane, ratio).
+
+        :return: {row: array of line indices} for the lines that are their
+            own neighbor.
+        """
+        if not len(rows):
+            return {}
+        cols, mask, cell_x, cell_y = self.relation(rows, ratios)
+        found = (mask & (cols == rows[:, None])).any(axis=1)
+        if skip_blank:
+            mask &= ~self.blank[cols]
+        r, c = np.nonzero(mask & found[:, None])
+        order = np.lexsort((cols[c], cell_x[r, c], cell_y[r, c], r))
+        r, c = r[order], cols[c[order]]
+        starts = np.flatnonzero(np.r_[True, r[1:] != r[:-1]]) if len(r) else np.empty(0, dtype=np.intp)
+        return dict(zip(rows[r[starts]].tolist(), np.split(c, starts[1:])))
+
+
+def group_textlines(self, laparams, lines):
+    """Patched class method that fixes empty line aggregation, and allows
+    run-time line margin detection. Produces the same boxes as
+    group_textlines_plane(), but answers the neighbor queries from a
+    TextLineIndex and merges line indices instead of intermediate boxes."""
+    if not all(isinstance(line, LTTextLineHorizontal) for line in lines):
+        yield from group_textlines_plane(self, laparams, lines)
+        return
+
+    index = TextLineIndex(lines, self.bbox)
+    neighbors = {}
+    for rows in index.blocks(np.flatnonzero(~index.blank)):
+        margins, found = index.paragraph_margins(rows, laparams.line_margin)
+        neighbors.update(index.neighbors(rows[found], margins[found], skip_blank=True))
+
+    # Box of each line, and lines of each box, by index.
+    box_of = {}
+    box_lines = []
+    for i in sorted(neighbors):
+        members = {}
+        for j in neighbors[i].tolist():
+            members[j] = None
+            if j in box_of:
+                members.update(dict.fromkeys(box_lines[box_of.pop(j)]))
+        for j in members:
+            box_of[j] = len(box_lines)
+        box_lines.append(list(members))
+
+    done = set()
+    for i in range(len(lines)):
+        if i not in box_of or box_of[i] in done:
+            continue
+        done.add(box_of[i])
+        box = LTTextBoxHorizontal()
+        for j in box_lines[box_of[i]]:
+            box.add(lines[j])
+        yield box
+
+
 # Patch the method
 LTLayoutContainer.group_textlines = group_textlines
 
@@ -103,49 +265,173 @@ class TextHandler(TextConverter):
         self.pages.append(paragraphs)
 
     def get_true_paragraphs(self):
-        # Drop redundant paragraphs
-        counter_by_page = Counter()
-        for page in self.pages:
-            for item in page:
-                counter_by_page[item['text']] += 1
-        redundant = set(x for x, y in counter_by_page.items() if y > 1)
-        for page in self.pages:
-            page[:] = list(filter(
-                lambda x: x['text'] not in redundant,
-                page
-            ))
-
-        # Drop number only paragraphs
-        printable = set(string.printable)
-        for page in self.pages:
-            new_page = []
-            for item in page:
-                normalized_text = ''.join((filter(lambda k: k in printable, item['text']))).strip()
-                words = re.findall(r'[a-zA-Z]', item['text'])
-                if len(words) > 0.5 * len(normalized_text):
-                    new_page.append(item)
-            page[:] = new_page
-
-        # Convert newlines and excessive whitespaces
-        for page in self.pages:
-            for word in page:
-                word['text'] = re.sub(r'\s+', ' ', word['text'])
-
-        return self.pages
-
-
-def extract_paragraphs_pdf(pdf_file, return_dicts=False, only_printable=True, laparams=None):
+        return get_true_paragraphs(self.pages)
+
+
+def text_key(text):
+    """Fixed size key of a paragraph text, so that texts can be counted without holding them."""
+    return hashlib.blake2b(text.encode('utf8', 'surrogatepass'), digest_size=16).digest()
+
+
+def count_texts(pages, counts=None):
+    """Count the text_key() of every paragraph of pages in counts, a new Counter if None."""
+    if counts is None:
+        counts = Counter()
+    for page in pages:
+        counts.update(text_key(item['text']) for item in page)
+    return counts
+
+
+def redundant_texts(counts):
+    """
+    Keys of the paragraph texts that occur more than once in a document, such
+    as headers and footers.
+
+    :param counts: The count_texts() of all pages of the document.
+    """
+    return set(x for x, y in counts.items() if y > 1)
+
+
+def clean_page(page, redundant):
+    """Clean up the paragraphs of a page, given the redundant_texts() of its document."""
+    # Drop redundant paragraphs
+    page = [x for x in page if text_key(x['text']) not in redundant]
+
+    # Drop number only paragraphs
+    page = [item for item in page if normalization.is_mostly_letters(item['text'])]
+
+    # Convert newlines and excessive whitespaces
+    for word in page:
+        word['text'] = normalization.collapse_whitespace(word['text'])
+
+    return page
+
+
+def get_true_paragraphs(pages):
+    """Clean up the paragraphs of all pages of a document, in place, and return the pages."""
+    redundant = redundant_texts(count_texts(pages))
+    for page in pages:
+        page[:] = clean_page(page, redundant)
+    return pages
+
+
+def page_content_bytes(page):
+    """Size of the decoded content streams of a PDFPage."""
+    size = 0
+    for stream in page.contents:
+        stream = resolve1(stream)
+        if isinstance(stream, PDFStream):
+            size += len(stream.get_data())
+    return size
+
+
+def pages_within_budget(pages, info, max_pages=None, max_bytes=None):
+    """
+    Yield PDFPages until max_pages pages, or until the next page would take
+    their content streams past max_bytes bytes.
+
+    :param info: Dict that receives "pages_processed", the number of pages
+        yielded, and "truncated", True if pages were left out.
+    """
+    info.update(pages_processed=0, truncated=False)
+    content_bytes = 0
+    for page in pages:
+        if max_pages is not None and info['pages_processed'] >= max_pages:
+            info['truncated'] = True
+            return
+        if max_bytes is not None:
+            content_bytes += page_content_bytes(page)
+            if content_bytes > max_bytes:
+                info['truncated'] = True
+                return
+        info['pages_processed'] += 1
+        yield page
+
+
+def iter_pdf_pages(pdf_file, info, laparams=None, part=0, parts=1, min_pages=1, max_pages=None, max_bytes=None):
+    """
+    Layout analysis of a PDF. Yields the paragraphs ({"text", "bbox"}) of
+    every page, before get_true_paragraphs(), as soon as the page is
+    analysed, so that only one page is held at a time.
+
+    To analyse a document in several processes, its pages are split into
+    ``parts`` contiguous ranges of at least ``min_pages`` pages, and only
+    range ``part`` is analysed. A document with too few pages has fewer
+    ranges, so a missing range yields no pages.
+
+    :param info: Dict that receives "pages_processed", the number of pages
+        within the budget, of all ranges, "truncated", True if the budget
+        left pages out, and "text_counts", the count_texts() of the yielded
+        pages. It is complete once the generator is exhausted.
+    :param max_pages: Only analyse up to this many pages, see pages_within_budget().
+    :param max_bytes: Only analyse up to this many bytes of page content.
     """
-    pdf_file is a file-like object.
-    This function will return lists of plain-text paragraphs."""
     parser = PDFParser(pdf_file)
     doc = PDFDocument(parser)
     rsrcmgr = PDFResourceManager()
     device = TextHandler(rsrcmgr, laparams=laparams)
     interpreter = PDFPageInterpreter(rsrcmgr, device)
-    for page in PDFPage.create_pages(doc):
+    counts = info['text_counts'] = Counter()
+    pages = pages_within_budget(PDFPage.create_pages(doc), info, max_pages=max_pages, max_bytes=max_bytes)
+    if parts > 1:
+        pages = list(pages)
+        parts = max(1, min(parts, len(pages) // max(min_pages, 1)))
+        pages = pages[len(pages) * part // parts:len(pages) * (part + 1) // parts]
+    for page in pages:
         interpreter.process_page(page)
+        page = device.pages.pop()
+        count_texts([page], counts)
+        yield page
+
+
+def extract_pdf_pages(pdf_file, **kwargs):
+    """
+    Same as iter_pdf_pages(), but returns the info dict, with the list of
+    pages in "pages".
+    """
+    info = {}
+    info['pages'] = list(iter_pdf_pages(pdf_file, info, **kwargs))
+    return info
+
+
+def extract_paragraphs_pdf(pdf_file, return_dicts=False, only_printable=True, laparams=None,
+                           max_pages=None, max_bytes=None, return_info=False):
+    """
+    pdf_file is a file-like object.
+    This function will return lists of plain-text paragraphs.
+
+    Only the first max_pages pages, and only pages up to max_bytes bytes of
+    page content are extracted. With return_info, (paragraphs, info) is
+    returned, where info has "pages_processed" and "truncated" (see
+    extract_pdf_pages())."""
+    info = extract_pdf_pages(pdf_file, laparams=laparams, max_pages=max_pages, max_bytes=max_bytes)
+    paragraphs = merge_pages(info.pop('pages'), return_dicts=return_dicts, only_printable=only_printable,
+                             text_counts=info.pop('text_counts'))
+    if return_info:
+        return paragraphs, info
+    return paragraphs
+
+
+def merge_pages(pages, return_dicts=False, only_printable=True, text_counts=None):
+    """
+    Turn the paragraphs of all pages, from iter_pdf_pages(), into the
+    paragraphs of the document: drop redundant paragraphs such as headers,
+    and join paragraphs that continue on the next page.
 
+    :param text_counts: The count_texts() of all pages. If None, they are
+        counted first, so pages must be a list.
+    """
+    return list(iter_paragraphs(pages, return_dicts=return_dicts, only_printable=only_printable,
+                                text_counts=text_counts))
+
+
+def iter_paragraphs(pages, return_dicts=False, only_printable=True, text_counts=None):
+    """
+    Same as merge_pages(), but yields the paragraphs page by page. With
+    text_counts, pages can be any iterable, e.g. a generator that reads them
+    one at a time; only the current page and the last paragraph are held,
+    until it is known whether the paragraph continues on the next page.
+    """
     def paragraph_pos_rank(p):
         x, y = p['bbox'][0], -p['bbox'][1]
         return int(y)
@@ -153,22 +439,24 @@ def extract_paragraphs_pdf(pdf_file, return_dicts=False, only_printable=True, la
     def is_ending_char(c):
         return re.match(r'!\.\?', c) is not None
 
-    paragraphs = []
+    if text_counts is None:
+        text_counts = count_texts(pages)
+    redundant = redundant_texts(text_counts)
+    last = None
 
-    printable = set(string.printable)
-    for page_num, page in enumerate(device.get_true_paragraphs()):
-        for j, p in enumerate(sorted(page, key=paragraph_pos_rank)):
+    for page_num, page in enumerate(pages):
+        for j, p in enumerate(sorted(clean_page(page, redundant), key=paragraph_pos_rank)):
             text = p['text']
 
             if only_printable:
-                text = ''.join(filter(lambda x: x in printable, text))
+                text = normalization.only_printable(text)
 
             text = text.strip()
 
             indention_level = int(p['bbox'][0] / 10)
 
-            if j == 0 and len(paragraphs) > 0:
-                last_paragraph = paragraphs[-1]
+            if j == 0 and last is not None:
+                last_paragraph = last
                 if return_dicts:
                     last_paragraph = last_paragraph['text']
                 should_join = (not is_ending_char(last_paragraph[-1]) and
@@ -177,45 +465,93 @@ def extract_paragraphs_pdf(pdf_file, return_dicts=False, only_printable=True, la
                 if should_join:
                     text = last_paragraph + ' ' + text
                     if return_dicts:
-                        indention_level = paragraphs[-1]['indention_level']
-                    del paragraphs[-1]
+                        indention_level = last['indention_level']
+                    last = None
 
+            if last is not None:
+                yield last
             if return_dicts:
-                paragraphs.append({
+                last = {
                     'text': text,
                     'page_num': page_num,
                     'indention_level': indention_level,
                     'bbox': p['bbox']
-                })
+                }
             else:
-                paragraphs.append(text)
+                last = text
 
-    return paragraphs
+    if last is not None:
+        yield last
 
 
-def _worker_another_process(pdf_data, pipe, kwargs):
-    pdf_file = BytesIO(pdf_data)
-    data = extract_paragraphs_pdf(pdf_file, **kwargs)
-    pipe.send(data)
-
-
-def extract_paragraphs_pdf_timeout(pdf_file, timeout=60, return_dicts=False, only_printable=True, laparams=None):
-    pipe1, pipe2 = Pipe(duplex=True)
-    process = Process(target=_worker_another_process,
-                      args=(pdf_file.read(), pipe2, {
-                          'return_dicts': return_dicts,
-                          'only_printable': only_printable,
-                          'laparams': laparams
-                      }))
-    process.start()
-    if pipe1.poll(timeout=timeout):
-        result = pipe1.recv()
-        process.join()
-        return result
-    else:
-        os.kill(process.pid, 9)
-        process.terminate()
-        raise TimeoutError('PDF extraction timeout')
+def spool_pages(spool, pages):
+    """Append pages to a spool file."""
+    for page in pages:
+        pickle.dump(page, spool, pickle.HIGHEST_PROTOCOL)
+
+
+def iter_spooled_pages(spool):
+    """Read the pages of a spool file back, one at a time."""
+    spool.seek(0)
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+
+def extract_paragraphs_pdf_timeout(pdf_file, timeout=60, return_dicts=False, only_printable=True, laparams=None,
+                                   page_workers=1, min_pages=20, max_pages=None, max_bytes=None, return_info=False):
+    """
+    Same as extract_paragraphs_pdf(), but the layout analysis runs in a
+    worker process of the shared PDFWorkerPool, which is killed and replaced
+    if it does not finish within timeout seconds.
+
+    The worker streams the pages back while it analyses them. They are
+    spooled (see PAGE_SPOOL_MEMORY) until the worker sends the text counts
+    of the document, which tell the redundant paragraphs, and then merged
+    page by page. So neither process holds all pages at once.
+
+    With page_workers > 1, documents of at least 2 * min_pages pages are
+    split into up to page_workers page ranges, which are analysed by
+    several workers at once, each within timeout seconds, and merged here.
+    The max_pages and max_bytes budgets apply to the whole document.
+    """
+    pdf_data = pdf_file.read()
+    pool = get_worker_pool()
+    kwargs = {
+        'laparams': laparams,
+        'max_pages': max_pages,
+        'max_bytes': max_bytes,
+    }
+    spools = [tempfile.SpooledTemporaryFile(max_size=PAGE_SPOOL_MEMORY) for _ in range(max(page_workers, 1))]
+    try:
+        def run(part):
+            part_kwargs = kwargs if page_workers <= 1 else dict(kwargs, part=part, parts=page_workers,
+                                                                 min_pages=min_pages)
+            return pool.run(pdf_data, part_kwargs, timeout=timeout, function='pages',
+                            on_items=lambda pages: spool_pages(spools[part], pages))
+
+        if page_workers <= 1:
+            results = [run(0)]
+        else:
+            with ThreadPoolExecutor(page_workers) as executor:
+                results = list(executor.map(run, range(page_workers)))
+
+        text_counts = Counter()
+        for result in results:
+            text_counts.update(result.pop('text_counts'))
+        pages = (page for spool in spools for page in iter_spooled_pages(spool))
+        paragraphs = merge_pages(pages, return_dicts=return_dicts, only_printable=only_printable,
+                                 text_counts=text_counts)
+    finally:
+        for spool in spools:
+            spool.close()
+
+    if return_info:
+        # All ranges were taken from the same pages within the budget.
+        return paragraphs, results[0]
+    return paragraphs
 
 
 if __name__ == '__main__':
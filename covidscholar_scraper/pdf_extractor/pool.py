@@ -0,0 +1,250 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+# Number of items that a worker sends to the parent in one message.
+STREAM_CHUNK_SIZE = 4
+
+
+class PDFExtractionError(Exception):
+    """Raised when a worker fails to extract a PDF."""
+
+
+def _get_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_main(conn):
+    # Make sure pdfminer is loaded before the first task arrives.
+    from .paragraphs import extract_paragraphs_pdf, iter_pdf_pages
+    functions = {
+        'paragraphs': extract_paragraphs_pdf,
+    }
+    # Generators, whose items are streamed to the parent in chunks while
+    # they run. They fill the info dict that they get, which is the result.
+    streams = {
+        'pages': iter_pdf_pages,
+    }
+
+    # Let the parent decide when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        function, pdf_data, kwargs = task
+        try:
+            if function in streams:
+                info = {}
+                chunk = []
+                for item in streams[function](BytesIO(pdf_data), info, **kwargs):
+                    chunk.append(item)
+                    if len(chunk) >= STREAM_CHUNK_SIZE:
+                        conn.send(('chunk', chunk))
+                        chunk = []
+                if chunk:
+                    conn.send(('chunk', chunk))
+                result = ('done', info)
+            else:
+                result = ('done', functions[function](BytesIO(pdf_data), **kwargs))
+        except Exception as e:
+            result = ('error', f'{e!r}\n{traceback.format_exc()}')
+        conn.send(result + (_get_rss(),))
+
+
+class _Worker(object):
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe(duplex=True)
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        try:
+            os.kill(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+class PDFWorkerPool(object):
+    """
+    A pool of long-lived PDF extraction processes.
+
+    Workers are forked once and inherit the already imported pdfminer, so
+    a PDF costs neither a fork nor the parser setup. Each call to
+    :meth:`run` borrows an idle worker and blocks the calling thread until
+    the result arrives.
+
+    A worker that does not answer in time is killed and replaced; workers
+    are also replaced after ``max_tasks`` tasks or once their RSS grows
+    past ``max_rss`` bytes.
+
+    :param size: Number of worker processes.
+    :param max_tasks: Tasks a worker handles before it is recycled.
+    :param max_rss: RSS in bytes above which a worker is recycled.
+    """
+
+    def __init__(self, size=2, max_tasks=200, max_rss=1024 ** 3):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_rss = max_rss
+
+        # Import pdfminer once before forking, so that workers inherit it.
+        from . import paragraphs  # noqa: F401
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context('fork')
+        else:
+            self.context = multiprocessing.get_context()
+
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._closed = False
+        for _ in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = _Worker(self.context)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker, kill=False):
+        with self._lock:
+            self._workers.discard(worker)
+        if kill:
+            worker.kill()
+        else:
+            worker.stop()
+        return self._spawn()
+
+    def run(self, pdf_data, kwargs, timeout=60, function='paragraphs', on_items=None):
+        """
+        Extract paragraphs from PDF bytes in a worker.
+
+        :param pdf_data: Bytes data of PDF file.
+        :param kwargs: Keyword arguments of the function.
+        :param timeout: Seconds that the worker may take, from when it is
+            acquired.
+        :param function: "paragraphs" for extract_paragraphs_pdf(), or
+            "pages" for iter_pdf_pages().
+        :param on_items: For "pages", called in this thread with every list
+            of pages that the worker streams while it analyses the PDF. If
+            None, the pages are collected in the result.
+        :return: The return value of the function. For "pages", the info
+            dict of iter_pdf_pages(), with the list of pages in "pages"
+            unless on_items is given.
+        """
+        if self._closed:
+            raise RuntimeError('PDF worker pool is closed')
+
+        items = []
+        worker = self._idle.get()
+        # Waiting for an idle worker does not count against the timeout.
+        deadline = time.monotonic() + timeout
+        try:
+            try:
+                worker.conn.send((function, pdf_data, kwargs))
+                message = self._receive(worker, deadline, items.extend if on_items is None else on_items)
+            except (EOFError, OSError) as e:
+                logger.warning('PDF worker %d died, replacing it: %r', worker.process.pid, e)
+                worker = self._replace(worker, kill=True)
+                raise PDFExtractionError('PDF worker died') from e
+            except Exception:
+                # The worker is still streaming, so it cannot take another task.
+                worker = self._replace(worker, kill=True)
+                raise
+
+            if message is None:
+                logger.warning('PDF worker %d timed out, replacing it', worker.process.pid)
+                worker = self._replace(worker, kill=True)
+                raise TimeoutError('PDF extraction timeout')
+
+            status, result, rss = message
+            worker.tasks += 1
+            if worker.tasks >= self.max_tasks or rss > self.max_rss:
+                logger.info('Recycling PDF worker %d after %d tasks (RSS %d MB)',
+                            worker.process.pid, worker.tasks, rss // 1024 ** 2)
+                worker = self._replace(worker)
+
+            if status == 'error':
+                raise PDFExtractionError(result)
+            if function == 'pages' and on_items is None:
+                result['pages'] = items
+            return result
+        finally:
+            self._idle.put(worker)
+
+    @staticmethod
+    def _receive(worker, deadline, consume):
+        """
+        Wait for the answer of a worker until the deadline, and pass the
+        chunks that it streams before to consume. Returns None on timeout.
+        """
+        while True:
+            if not worker.conn.poll(max(deadline - time.monotonic(), 0)):
+                return None
+            message = worker.conn.recv()
+            if message[0] != 'chunk':
+                return message
+            consume(message[1])
+
+    def close(self):
+        """Stop all workers."""
+        self._closed = True
+        with self._lock:
+            workers, self._workers = self._workers, set()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(**kwargs) -> PDFWorkerPool:
+    """
+    Returns the process-wide worker pool. It is created with ``kwargs``
+    (see :class:`PDFWorkerPool`) on the first call.
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = PDFWorkerPool(**kwargs)
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,185 @@
+"""
+Extracts PDFs that spiders stored with pdf_extraction_status "pending"
+(PDF_EXTRACTION_MODE = 'deferred'), across all *_fs GridFS buckets.
+
+Usage: python -m covidscholar_scraper.pdf_extractor.worker [--processes N] [--watch SECONDS]
+"""
+import argparse
+import io
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+
+from ..db import IndexRegistry, PDFContentIndex, get_database, get_index_registry, get_pdf_content_index, \
+    read_gridfs_file
+from . import EXTRACTOR_VERSION
+from .paragraphs import extract_paragraphs_pdf_timeout
+from .pool import get_worker_pool
+
+logger = logging.getLogger(__name__)
+
+# Files claimed for longer than this are assumed to belong to a dead worker.
+STALE_CLAIM = timedelta(hours=1)
+
+
+def find_buckets(db):
+    """Names of all GridFS buckets that spiders store PDFs in."""
+    return sorted(
+        name[:-len('.files')] for name in db.list_collection_names()
+        if name.endswith('_fs.files'))
+
+
+class PendingPDFExtractor(object):
+    """
+    Claims pending PDFs one at a time and extracts them in a PDFWorkerPool.
+
+    :param db: The database.
+    :param buckets: GridFS bucket names to drain.
+    :param processes: Number of extraction processes.
+    :param index_registry: Registry used to ensure the pdf_extraction_status
+        index on the buckets.
+    :param timeout: Seconds allowed per PDF.
+    :param page_workers: Split the pages of large PDFs across up to this
+        many processes, see extract_paragraphs_pdf_timeout().
+    :param min_pages: Minimum number of pages per process.
+    :param content_index: If given, successfully extracted PDFs are registered
+        in it, so that spiders reuse them.
+    """
+
+    def __init__(self, db, buckets, processes, index_registry: IndexRegistry, timeout=60,
+                 content_index: PDFContentIndex = None, page_workers=1, min_pages=20):
+        self.db = db
+        self.content_index = content_index
+        self.buckets = buckets
+        self.processes = processes
+        self.timeout = timeout
+        self.page_workers = page_workers
+        self.min_pages = min_pages
+        self.pool = get_worker_pool(size=processes)
+
+        for bucket in buckets:
+            index_registry.ensure(self.db[bucket + '.files'], ['pdf_extraction_status'])
+
+    def claim(self, bucket):
+        now = datetime.now()
+        return self.db[bucket + '.files'].find_one_and_update(
+            {'$or': [
+                {'pdf_extraction_status': 'pending'},
+                {'pdf_extraction_status': 'processing', 'pdf_extraction_claimed': {'$lt': now - STALE_CLAIM}},
+            ]},
+            {'$set': {'pdf_extraction_status': 'processing', 'pdf_extraction_claimed': now}},
+            projection={'filename': 1, 'pdf_laparams': 1, 'sha256': 1,
+                        'pdf_max_pages': 1, 'pdf_max_bytes': 1},
+            return_document=ReturnDocument.AFTER)
+
+    def extract(self, bucket, file_doc):
+        pdf_data = read_gridfs_file(self.db, bucket, file_doc['_id'])
+        try:
+            paragraphs, info = extract_paragraphs_pdf_timeout(
+                io.BytesIO(pdf_data), timeout=self.timeout, return_dicts=True,
+                laparams=file_doc.get('pdf_laparams'), page_workers=self.page_workers, min_pages=self.min_pages,
+                max_pages=file_doc.get('pdf_max_pages'), max_bytes=file_doc.get('pdf_max_bytes'), return_info=True)
+            update = {
+                'pdf_extraction_status': 'done',
+                'pdf_extraction_success': True,
+                'pdf_extraction_plist': paragraphs,
+                'pdf_extraction_exec': None,
+                'pdf_extractor_version': EXTRACTOR_VERSION,
+                'pdf_extraction_pages': info['pages_processed'],
+                'pdf_extraction_truncated': info['truncated'],
+                'parsed_date': datetime.now(),
+            }
+        except Exception as e:
+            logger.exception('Cannot parse pdf for file %s', file_doc.get('filename'))
+            update = {
+                'pdf_extraction_status': 'failed',
+                'pdf_extraction_success': False,
+                'pdf_extraction_plist': None,
+                'pdf_extraction_exec': f'Failed to extract PDF {file_doc.get("filename")} {e}' +
+                                       traceback.format_exc(),
+                'parsed_date': datetime.now(),
+            }
+
+        self.db[bucket + '.files'].update_one(
+            {'_id': file_doc['_id']},
+            {'$set': update, '$unset': {'pdf_extraction_claimed': ''}})
+
+        if self.content_index is not None and update['pdf_extraction_success'] and file_doc.get('sha256'):
+            self.content_index.register(
+                file_doc['sha256'], EXTRACTOR_VERSION, file_doc.get('pdf_laparams'),
+                bucket, file_doc['_id'], file_doc.get('pdf_max_pages'), file_doc.get('pdf_max_bytes'))
+        return update['pdf_extraction_success']
+
+    def drain_bucket(self, bucket):
+        done = 0
+        while True:
+            file_doc = self.claim(bucket)
+            if file_doc is None:
+                return done
+            self.extract(bucket, file_doc)
+            done += 1
+
+    def drain(self):
+        """Extract pending PDFs until none is left. Returns the number of PDFs processed."""
+        with ThreadPoolExecutor(max_workers=self.processes) as executor:
+            # Every thread drives one worker process and walks the buckets
+            # in its own order, so that they do not all queue on one bucket.
+            futures = [
+                executor.submit(
+                    lambda offset: sum(self.drain_bucket(bucket)
+                                       for bucket in self.buckets[offset:] + self.buckets[:offset]),
+                    i % max(len(self.buckets), 1))
+                for i in range(self.processes)]
+            return sum(f.result() for f in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract PDFs stored with pdf_extraction_status "pending".')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                        help='Number of extraction processes (default: number of CPUs).')
+    parser.add_argument('--timeout', type=int, default=60, help='Seconds allowed per PDF.')
+    parser.add_argument('--page-workers', type=int, default=None,
+                        help='Split the pages of large PDFs across up to this many processes '
+                             '(default: PDF_PAGE_WORKERS setting).')
+    parser.add_argument('--bucket', action='append', dest='buckets',
+                        help='GridFS bucket to drain, e.g. Scraper_chemrxiv_org_fs. May be repeated. '
+                             'Default: all *_fs buckets.')
+    parser.add_argument('--watch', type=int, default=0, metavar='SECONDS',
+                        help='Keep running, and look for new pending PDFs every SECONDS.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(name)s] %(levelname)s: %(message)s')
+
+    os.environ.setdefault('SCRAPY_SETTINGS_MODULE', 'covidscholar_scraper.settings')
+    from scrapy.utils.project import get_project_settings
+    settings = get_project_settings()
+    db = get_database(settings)
+    index_registry = get_index_registry(settings, db)
+    content_index = None
+    if settings.getbool('PDF_CONTENT_DEDUP', True):
+        content_index = get_pdf_content_index(settings, db)
+
+    while True:
+        buckets = args.buckets or find_buckets(db)
+        extractor = PendingPDFExtractor(
+            db, buckets, processes=args.processes, index_registry=index_registry, timeout=args.timeout,
+            content_index=content_index,
+            page_workers=args.page_workers or settings.getint('PDF_PAGE_WORKERS', 1),
+            min_pages=settings.getint('PDF_PAGE_WORKERS_MIN_PAGES', 20))
+        started = time.time()
+        count = extractor.drain()
+        logger.info('Processed %d pending PDFs from %d buckets in %.1f seconds',
+                    count, len(buckets), time.time() - started)
+
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Cheap change-detection probes for job.py.
+
+A probe fetches one small signal of a source, such as the id of its newest
+item, so that the scheduler only starts the full crawl when the signal
+changed since the last successful crawl. Requests carry the last ETag, and
+a 304 response counts as unchanged.
+"""
+import hashlib
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+PROBE_TIMEOUT = 30
+USER_AGENT = 'Mozilla/5.0 (compatible; covidscholar-probe)'
+
+
+def http_fetch(url, body: bytes = None, headers: dict = None, etag=None):
+    """
+    Fetch a URL (POST if body is given).
+
+    :return: (response body, ETag). The body is None if the server answered
+        304 Not Modified to ``etag``.
+    """
+    headers = dict(headers or {}, **{'User-Agent': USER_AGENT})
+    if etag:
+        headers['If-None-Match'] = etag
+
+    request = urllib.request.Request(url, data=body, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=PROBE_TIMEOUT) as response:
+            return response.read(), response.headers.get('ETag')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None, etag
+        raise
+
+
+def set_query(url, **params):
+    """Replace query parameters of a URL."""
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    query.update({key: str(value) for key, value in params.items()})
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def probe_zenodo(etag):
+    from .spiders.zenodo import ZenodoSpider
+
+    body, etag = http_fetch(set_query(ZenodoSpider.start_urls[0], size=1), etag=etag)
+    if body is None:
+        return None, etag
+    data = json.loads(body)
+    return json.dumps([data['hits']['total'], [x['doi'] for x in data['hits']['hits']]]), etag
+
+
+def probe_nber(etag):
+    body, etag = http_fetch(
+        'https://www.nber.org/api/v1/working_page_listing/'
+        'contentType/working_paper/_/_/search?page=1&perPage=1&sortBy=public_date', etag=etag)
+    if body is None:
+        return None, etag
+    return json.dumps([x['url'] for x in json.loads(body)['results']]), etag
+
+
+def probe_preprints_org(etag):
+    from parsel import Selector
+    from .spiders.preprints_org import PrePrintsOrgSpider
+
+    body, etag = http_fetch(PrePrintsOrgSpider.url.format(page_num=1), etag=etag)
+    if body is None:
+        return None, etag
+    selector = Selector(text=body.decode('utf8', errors='replace'))
+    return json.dumps(selector.xpath(
+        '//div[contains(@class, "search-wrapper")]/div//a[@class="title"]/@href').extract()[:5]), etag
+
+
+def probe_chemrxiv(etag):
+    from .spiders.chemrxiv import ChemrxivSpider
+
+    body, etag = http_fetch(set_query(ChemrxivSpider().build_query_url(), limit=1), etag=etag)
+    if body is None:
+        return None, etag
+    return json.dumps([
+        [x['data']['title'], x['data']['publishedDate']] for x in json.loads(body)['items']]), etag
+
+
+def probe_lens(etag):
+    from .spiders.lens_patent_spider import PatentSpider
+
+    # The same window as PatentSpider.start_requests().
+    today = datetime.now()
+    url, payload = PatentSpider.build_lens_url({
+        'publishedDate.from': (today - timedelta(days=90)).strftime('%Y-%m-%d'),
+        'publishedDate.to': today.strftime('%Y-%m-%d'),
+    })
+    payload = json.loads(payload)
+    payload['size'] = '1'
+    body, etag = http_fetch(
+        url, body=json.dumps(payload).encode('utf8'), headers={'content-type': 'application/json'}, etag=etag)
+    if body is None:
+        return None, etag
+    return json.dumps([x['lensId'] for x in json.loads(body)['hits']]), etag
+
+
+PROBES = {
+    'zenodo': probe_zenodo,
+    'nber': probe_nber,
+    'preprints_org': probe_preprints_org,
+    'chemrxiv': probe_chemrxiv,
+    'lens': probe_lens,
+}
+
+
+def run_probe(name, previous: dict) -> dict:
+    """
+    Run a probe.
+
+    :param name: Name of the probe in PROBES.
+    :param previous: The result of the last probe that led to a crawl, or {}.
+    :return: {"digest": SHA-256 of the signal, "etag": ETag}. The digest is
+        the previous one if the server answered 304 Not Modified.
+    """
+    signal, etag = PROBES[name](previous.get('etag'))
+    if signal is None:
+        return dict(previous)
+    return {'digest': hashlib.sha256(signal.encode('utf8')).hexdigest(), 'etag': etag}
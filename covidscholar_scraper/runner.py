@@ -0,0 +1,113 @@
+import threading
+
+from scrapy.crawler import Crawler, CrawlerRunner
+from scrapy.settings import Settings
+from scrapy.utils.log import configure_logging
+from scrapy.utils.project import get_project_settings
+from scrapy.utils.reactor import install_reactor
+from twisted.internet import defer
+
+
+class CrawlTimeout(Exception):
+    """
+    Raised when a crawl did not stop after its budget and grace period.
+
+    :param finished: A threading.Event that is set when the abandoned crawl
+        finally stops.
+    """
+
+    def __init__(self, message, finished: threading.Event):
+        super(CrawlTimeout, self).__init__(message)
+        self.finished = finished
+
+
+class InProcessRunner(object):
+    """
+    Runs spiders in a reactor thread of this process, so that consecutive
+    crawls share the imported spider modules, the Mongo connection pool and
+    the PDF worker pool instead of starting a new interpreter each time.
+
+    :param settings: The project settings. Loaded from scrapy.cfg if None.
+    """
+
+    def __init__(self, settings: Settings = None):
+        self.settings = settings or get_project_settings()
+
+        reactor_class = self.settings.get('TWISTED_REACTOR')
+        if reactor_class:
+            install_reactor(reactor_class)
+        from twisted.internet import reactor
+        self.reactor = reactor
+
+        configure_logging(self.settings)
+        self.runner = CrawlerRunner(self.settings)
+
+        self.thread = threading.Thread(
+            target=self.reactor.run, kwargs={'installSignalHandlers': False},
+            name='reactor', daemon=True)
+        self.thread.start()
+
+    def crawl(self, spider_name, settings: dict = None, timeout=None, grace=60) -> dict:
+        """
+        Run a spider to completion. Blocks the calling thread, which must not
+        be the reactor thread.
+
+        If the crawl runs longer than ``timeout`` seconds, it is stopped like
+        on SIGTERM. If it still runs ``grace`` seconds later, CrawlTimeout is
+        raised and the crawl is left to the reactor. The crawl cannot be
+        killed in this process, so callers must not start the spider again
+        before ``CrawlTimeout.finished`` is set.
+
+        :param spider_name: Name of the spider.
+        :param settings: Settings of this crawl only, like "scrapy crawl -s".
+        :param timeout: Runtime budget in seconds, or None.
+        :param grace: Seconds to wait for a stopped crawl.
+        :return: The stats of the crawl, with "timed_out" set if it was stopped.
+        """
+        done = threading.Event()
+        result = {}
+        crawlers = []
+
+        def finished(value):
+            result['value'] = value
+            done.set()
+
+        def start():
+            d = defer.maybeDeferred(self._crawl, spider_name, settings or {}, crawlers)
+            d.addBoth(finished)
+
+        self.reactor.callFromThread(start)
+        if done.wait(timeout):
+            return self._result(result['value'])
+
+        self.reactor.callFromThread(lambda: crawlers and crawlers[0].stop())
+        if not done.wait(grace):
+            raise CrawlTimeout(f'Crawl of {spider_name} did not stop {grace} seconds after its budget', done)
+        stats = self._result(result['value'])
+        stats['timed_out'] = True
+        return stats
+
+    @staticmethod
+    def _result(value):
+        from twisted.python.failure import Failure
+
+        if isinstance(value, Failure):
+            value.raiseException()
+        return value
+
+    def _crawl(self, spider_name, settings, crawlers):
+        crawl_settings = self.settings.copy()
+        crawl_settings.setdict(settings, priority='cmdline')
+        crawler = Crawler(self.runner.spider_loader.load(spider_name), crawl_settings)
+        crawlers.append(crawler)
+
+        d = self.runner.crawl(crawler)
+        d.addCallback(lambda _: crawler.stats.get_stats())
+        return d
+
+    def stop(self):
+        """Stop all crawls and the reactor."""
+        from twisted.internet import threads
+
+        threads.blockingCallFromThread(self.reactor, self.runner.stop)
+        self.reactor.callFromThread(self.reactor.stop)
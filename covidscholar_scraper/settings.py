@@ -14,6 +14,7 @@ BOT_NAME = 'covidscholar_scraper'
 
 SPIDER_MODULES = ['covidscholar_scraper.spiders']
 NEWSPIDER_MODULE = 'covidscholar_scraper.spiders'
+COMMANDS_MODULE = 'covidscholar_scraper.commands'
 
 USER_AGENT = 'COVID-19 Scholar: Text-mining for COVID-19 research @ LBNL ' \
              '(+http://covidscholar.org/) ' \
@@ -59,7 +60,8 @@ DOWNLOAD_DELAY = 10
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 EXTENSIONS = {
-    'covidscholar_scraper.extensions.SentryLogging': -1,
+    'covidscholar_scraper.extensions.SentryTelemetry': -1,
+    'covidscholar_scraper.extensions.JobRunHistory': 0,
 }
 
 # Configure item pipelines
@@ -94,7 +96,69 @@ MONGO_DB = os.environ['MONGO_DB']
 MONGO_USERNAME = os.environ['MONGO_USERNAME']
 MONGO_PASSWORD = os.environ['MONGO_PASSWORD']
 MONGO_AUTHENTICATION_DB = os.environ['MONGO_AUTHENTICATION_DB']
+
+# All spiders in a process share one pooled MongoClient built from these.
+MONGO_MAX_POOL_SIZE = 50
+# Comma separated wire compressors, in order of preference ("zlib" needs no extra packages).
+MONGO_COMPRESSORS = 'zlib'
+MONGO_CONNECT_TIMEOUT_MS = 20000
+MONGO_SOCKET_TIMEOUT_MS = 300000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 30000
+# Collection for the scraper's own bookkeeping, e.g. which indexes were created.
+MONGO_METADATA_COLLECTION = 'Scraper_metadata'
+# Collection with one record per scheduled run, see job.py.
+JOB_HISTORY_COLLECTION = 'Scraper_job_history'
+
 SENTRY_DSN = os.environ.get('SENTRY_DSN', None)
+# Seconds between the telemetry summaries sent to Sentry while a spider runs.
+# A final summary is always sent when the spider closes.
+SENTRY_SUMMARY_INTERVAL = 600
+
+# Articles are buffered per collection and written with unordered bulk
+# inserts once a buffer holds this many documents or bytes, or when its
+# oldest document has waited this many seconds.
+MONGO_WRITE_BUFFER_SIZE = 100
+MONGO_WRITE_BUFFER_BYTES = 16 * 1024 * 1024
+MONGO_WRITE_BUFFER_SECONDS = 5
+
+# Load the duplicate check keys declared by spiders (BaseSpider.dedup_keys)
+# into memory. Only the listing spiders that check every listing entry
+# declare them, since loading a key scans the whole collection. Collections
+# larger than the threshold are held in a Bloom filter, and hits are
+# confirmed by a database query.
+DEDUP_INDEX_ENABLED = True
+DEDUP_INDEX_BLOOM_THRESHOLD = 1000000
+
+# Number of PDF extraction worker processes, i.e. PDFs extracted
+# concurrently. A worker is replaced after PDF_WORKER_MAX_TASKS PDFs, or
+# once its resident memory exceeds PDF_WORKER_MAX_RSS_MB.
+PDF_WORKERS = 2
+PDF_WORKER_MAX_TASKS = 200
+PDF_WORKER_MAX_RSS_MB = 1024
+
+# Split the pages of a PDF with at least 2 * PDF_PAGE_WORKERS_MIN_PAGES pages
+# into up to PDF_PAGE_WORKERS ranges, which are analysed by several workers
+# at once, each within the timeout. 1 disables the split.
+PDF_PAGE_WORKERS = 1
+PDF_PAGE_WORKERS_MIN_PAGES = 20
+
+# "inline": extract PDFs while crawling. "deferred": only store them, with
+# pdf_extraction_status "pending"; run
+#   python -m covidscholar_scraper.pdf_extractor.worker
+# to extract all pending PDFs.
+PDF_EXTRACTION_MODE = 'inline'
+
+# Reuse the extraction of stored PDFs with the same SHA-256, extractor
+# version (pdf_extractor.EXTRACTOR_VERSION), laparams and budget, across all
+# spiders. Hashes are kept in PDF_CONTENT_COLLECTION. Within a bucket the
+# existing file is reused.
+PDF_CONTENT_DEDUP = True
+PDF_CONTENT_COLLECTION = 'Scraper_pdf_content'
+# Another bucket stores an empty file with the extraction results, whose
+# "content_bucket" and "content_file_id" reference the file that holds the
+# PDF. Readers of the PDF bytes must follow them (db.read_gridfs_file() does).
+# Set to False to store a copy of the PDF instead.
+PDF_CONTENT_REFERENCES = True
 
 COVIDSCHOLAR_RECEIVER_EMAIL = os.environ.get('COVIDSCHOLAR_RECEIVER_EMAIL', None)
 COVIDSCHOLAR_RECEIVER_PASSWORD = os.environ.get('COVIDSCHOLAR_RECEIVER_PASSWORD', None)
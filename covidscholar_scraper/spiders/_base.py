@@ -5,19 +5,48 @@ from typing import Dict, Union, Optional
 
 import gridfs
 import scrapy
-import sentry_sdk
 from bs4 import BeautifulSoup
-from pymongo import MongoClient
 from pymongo.collection import Collection
 from pymongo.database import Database
+from scrapy import signals
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
 
+from ..db import BufferedWriter, DedupIndex, PDFContentIndex, get_database, get_index_registry, \
+    get_pdf_content_index, sha256_digest
+from ..extensions import ARTICLES_SAVED, PDF_BYTES, PDF_EXTRACTION_FAILURES, PDFS_REUSED, PDFS_STORED
 from ..html_extractor.paragraphs import extract_paragraphs_recursive, get_tag_text
-from ..pdf_extractor.paragraphs import extract_paragraphs_pdf_timeout
+from ..pdf_extractor import EXTRACTOR_VERSION
+from ..pdf_extractor.pool import get_worker_pool
+
+# Threads that wait for PDF extraction. Kept apart from the reactor thread
+# pool, which scrapy also uses for DNS lookups.
+_pdf_thread_pool: Optional[ThreadPool] = None
+
+
+def get_pdf_thread_pool(size) -> ThreadPool:
+    global _pdf_thread_pool
+    from twisted.internet import reactor
+
+    if _pdf_thread_pool is None:
+        _pdf_thread_pool = ThreadPool(minthreads=1, maxthreads=size, name='pdf_extraction')
+        _pdf_thread_pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _pdf_thread_pool.stop)
+    return _pdf_thread_pool
 
 
 class BaseSpider(scrapy.Spider):
     # PDF parsing LA Params.
     pdf_laparams = None
+    # PDF extraction budget: only the first pdf_max_pages pages, and only
+    # pages up to pdf_max_bytes bytes of page content are extracted.
+    pdf_max_pages = None
+    pdf_max_bytes = None
+
+    # Duplicate check keys, i.e. {collection name: field}. The values of
+    # these fields are loaded into memory once, and has_duplicate() answers
+    # single-field queries on them without querying the database.
+    dedup_keys = {}
 
     def __init__(self, *args, **kwargs):
         super(BaseSpider, self).__init__(*args, **kwargs)
@@ -27,14 +56,21 @@ class BaseSpider(scrapy.Spider):
         self.db: Database = None
         self.collections: Dict[str, Collection] = {}
         self.gridfs: Dict[str, gridfs.GridFS] = {}
+        self.dedup_indices: Dict[str, DedupIndex] = {}
+        self.pdf_content_index: Optional[PDFContentIndex] = None
+        self.writer: BufferedWriter = None
+        self._flush_task = None
 
-    def closed(self, reason):
-        if self.settings['SENTRY_DSN']:
-            with sentry_sdk.push_scope() as scope:
-                scope.set_extra("reason", reason)
-                sentry_sdk.capture_message('Scraper %s finished' % (self.name,))
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super(BaseSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.flush_articles, signal=signals.spider_idle)
+        return spider
 
-            sentry_sdk.flush()
+    def closed(self, reason):
+        if self._flush_task is not None and self._flush_task.running:
+            self._flush_task.stop()
+        self.flush_articles()
 
     @property
     def collections_config(self) -> dict:
@@ -59,22 +95,50 @@ class BaseSpider(scrapy.Spider):
         """
         raise NotImplementedError
 
-    def parse_pdf(self, pdf_data, filename):
+    def parse_pdf(self, pdf_data, filename) -> defer.Deferred:
+        """
+        Extract paragraphs from a PDF without blocking the reactor.
+
+        :param pdf_data: Bytes data of PDF file.
+        :param filename: PDF filename, used in log messages.
+        :return: A Deferred that fires with the PDF extraction metadata.
+        """
+        # Both are created once per process, by the first spider that parses a PDF.
+        get_worker_pool(
+            size=self.settings.getint('PDF_WORKERS', 2),
+            max_tasks=self.settings.getint('PDF_WORKER_MAX_TASKS', 200),
+            max_rss=self.settings.getint('PDF_WORKER_MAX_RSS_MB', 1024) * 1024 ** 2)
+        from twisted.internet import reactor
+
+        pool = get_pdf_thread_pool(self.settings.getint('PDF_WORKERS', 2))
+        return threads.deferToThreadPool(reactor, pool, self.parse_pdf_blocking, pdf_data, filename)
+
+    def parse_pdf_blocking(self, pdf_data, filename):
+        from ..pdf_extractor.paragraphs import extract_paragraphs_pdf_timeout
+
         data = io.BytesIO(pdf_data)
         try:
-            paragraphs = extract_paragraphs_pdf_timeout(
-                data, laparams=self.pdf_laparams, return_dicts=True)
+            paragraphs, info = extract_paragraphs_pdf_timeout(
+                data, laparams=self.pdf_laparams, return_dicts=True,
+                page_workers=self.settings.getint('PDF_PAGE_WORKERS', 1),
+                min_pages=self.settings.getint('PDF_PAGE_WORKERS_MIN_PAGES', 20),
+                max_pages=self.pdf_max_pages, max_bytes=self.pdf_max_bytes, return_info=True)
             return {
+                'pdf_extraction_status': 'done',
                 'pdf_extraction_success': True,
                 'pdf_extraction_plist': paragraphs,
                 'pdf_extraction_exec': None,
                 'pdf_extraction_version': self.pdf_parser_version,
+                'pdf_extractor_version': EXTRACTOR_VERSION,
+                'pdf_extraction_pages': info['pages_processed'],
+                'pdf_extraction_truncated': info['truncated'],
                 'parsed_date': datetime.now(),
             }
         except Exception as e:
             self.logger.exception(f'Cannot parse pdf for file {filename}')
             exc = f'Failed to extract PDF {filename} {e}' + traceback.format_exc()
             return {
+                'pdf_extraction_status': 'failed',
                 'pdf_extraction_success': False,
                 'pdf_extraction_plist': None,
                 'pdf_extraction_exec': exc,
@@ -122,7 +186,7 @@ class BaseSpider(scrapy.Spider):
         :param article: The processed article item.
         :param to: The collection to save to.
         :param push_lowercase_to_meta: Whether the lower case keys should be pushed into meta document.
-        :return:
+        :return: The ObjectId of the article. It is written by the next buffer flush.
         """
         if push_lowercase_to_meta:
             meta_dict = {}
@@ -134,42 +198,131 @@ class BaseSpider(scrapy.Spider):
 
         article['last_updated'] = datetime.now()
 
-        result = self.get_col(to).insert_one(article)
+        # Buffered: the article is written by the next bulk insert into this collection.
+        col = self.get_col(to)
+        inserted_id = self.get_writer().insert(col, article)
+
+        index = self.dedup_indices.get(col.name)
+        if index is not None:
+            index.add(article.get(index.key))
+
+        self.crawler.stats.inc_value(ARTICLES_SAVED, spider=self)
 
-        if self.settings['SENTRY_DSN']:
-            with sentry_sdk.push_scope() as scope:
-                scope.set_extra('item_id', str(result.inserted_id))
-                sentry_sdk.capture_message('Scraper %s: Article download' % (self.name,))
-            sentry_sdk.flush()
+        return inserted_id
 
-    def save_pdf(self, pdf_bytes, pdf_fn, pdf_link, fs: Union[gridfs.GridFS, str]):
+    def save_pdf(self, pdf_bytes, pdf_fn, pdf_link, fs: Union[gridfs.GridFS, str]) -> defer.Deferred:
         """
         Process PDF bytes and save it into a GridFS collection.
 
+        If PDF_EXTRACTION_MODE is "deferred", the PDF is stored right away
+        with pdf_extraction_status "pending", and extracted later by
+        ``python -m covidscholar_scraper.pdf_extractor.worker``.
+        If a PDF with the same SHA-256 was already extracted, by any spider,
+        with the same extractor version, pdf_laparams and budget, its
+        extraction is reused instead of parsing the PDF again (see _reuse_pdf()).
+        Otherwise, the PDF is parsed off the reactor thread, so callbacks should
+        return the Deferred (or one chained to it) to scrapy, e.g.::
+
+            d = self.save_pdf(...)
+            d.addCallback(lambda file_id: self.save_article(...))
+            return d
+
         :param pdf_bytes: Bytes data of PDF file.
         :param pdf_fn: PDF filename.
         :param pdf_link: Link to PDF file.
         :param fs: GridFS in which PDF files are saved, or a name.
-        :return: The ObjectId for this object in the GridFS.
+        :return: A Deferred that fires with the ObjectId for this object in the GridFS.
         """
-        parsing_result = self.parse_pdf(pdf_bytes, pdf_fn)
+        fs = self.get_gridfs(fs)
+        sha256 = sha256_digest(pdf_bytes)
+        if self.pdf_content_index is not None:
+            existing = self.pdf_content_index.find(
+                sha256, EXTRACTOR_VERSION, self.pdf_laparams, self.pdf_max_pages, self.pdf_max_bytes)
+            if existing is not None:
+                return defer.succeed(self._reuse_pdf(existing, sha256, pdf_bytes, pdf_fn, pdf_link, fs))
+
+        if self.settings.get('PDF_EXTRACTION_MODE', 'inline') == 'deferred':
+            d = defer.succeed({
+                'pdf_extraction_status': 'pending',
+                'pdf_extraction_success': None,
+                'pdf_extraction_plist': None,
+                'pdf_extraction_exec': None,
+                'pdf_extraction_version': self.pdf_parser_version,
+                'parsed_date': None,
+            })
+        else:
+            d = self.parse_pdf(pdf_bytes, pdf_fn)
+        d.addCallback(self._store_pdf, pdf_bytes, pdf_fn, pdf_link, fs, sha256)
+        return d
+
+    def _store_pdf(self, parsing_result, pdf_bytes, pdf_fn, pdf_link, fs: gridfs.GridFS, sha256):
         meta = parsing_result.copy()
         meta.update({
             'filename': pdf_fn,
             'page_link': pdf_link,
+            'pdf_laparams': self.pdf_laparams,
+            'pdf_max_pages': self.pdf_max_pages,
+            'pdf_max_bytes': self.pdf_max_bytes,
+            'sha256': sha256,
         })
-        file_id = self.get_gridfs(fs).put(pdf_bytes, **meta)
+        file_id = fs.put(pdf_bytes, **meta)
+
+        if self.pdf_content_index is not None and meta['pdf_extraction_status'] == 'done':
+            self.pdf_content_index.register(
+                sha256, EXTRACTOR_VERSION, self.pdf_laparams, self._bucket_name(fs), file_id,
+                self.pdf_max_pages, self.pdf_max_bytes)
+
+        stats = self.crawler.stats
+        stats.inc_value(PDFS_STORED, spider=self)
+        stats.inc_value(PDF_BYTES, len(pdf_bytes), spider=self)
+        if meta['pdf_extraction_success'] is False:
+            stats.inc_value(PDF_EXTRACTION_FAILURES, spider=self)
+
+        return file_id
+
+    def _reuse_pdf(self, existing, sha256, pdf_bytes, pdf_fn, pdf_link, fs: gridfs.GridFS):
+        """
+        Reuse the extraction of an already extracted PDF with the same content.
+        In the same bucket, the existing file is returned and this download is
+        recorded in its "duplicate_downloads".
+
+        In another bucket, an empty file is stored that carries the extraction
+        results, and references the file that holds the content with
+        "content_bucket" and "content_file_id"; db.read_gridfs_file() follows
+        the reference. If PDF_CONTENT_REFERENCES is False, the file holds a
+        copy of the PDF instead, for readers that read the bucket directly,
+        and "pdf_extraction_reused_from" names the file of the extraction.
+        """
+        self.crawler.stats.inc_value(PDFS_REUSED, spider=self)
 
-        if self.settings['SENTRY_DSN']:
-            with sentry_sdk.push_scope() as scope:
-                scope.set_extra('filename', pdf_fn)
-                scope.set_extra('page_link', pdf_link)
-                scope.set_extra('file_id', str(file_id))
-                sentry_sdk.capture_message('Scraper %s: PDF download' % (self.name,))
-            sentry_sdk.flush()
+        bucket = self._bucket_name(fs)
+        if existing['bucket'] == bucket:
+            getattr(fs, '_GridFS__files').update_one(
+                {'_id': existing['_id']},
+                {'$addToSet': {'duplicate_downloads': {'filename': pdf_fn, 'page_link': pdf_link}}})
+            return existing['_id']
 
+        meta = {key: existing.get(key) for key in PDFContentIndex.FIELDS}
+        meta.update({
+            'filename': pdf_fn,
+            'page_link': pdf_link,
+            'sha256': sha256,
+            'pdf_extraction_version': self.pdf_parser_version,
+        })
+        if self.settings.getbool('PDF_CONTENT_REFERENCES', True):
+            return fs.put(b'', content_bucket=existing['bucket'], content_file_id=existing['_id'], **meta)
+
+        meta['pdf_extraction_reused_from'] = {'bucket': existing['bucket'], 'file_id': existing['_id']}
+        file_id = fs.put(pdf_bytes, **meta)
+        stats = self.crawler.stats
+        stats.inc_value(PDFS_STORED, spider=self)
+        stats.inc_value(PDF_BYTES, len(pdf_bytes), spider=self)
         return file_id
 
+    @staticmethod
+    def _bucket_name(fs: gridfs.GridFS) -> str:
+        return getattr(fs, '_GridFS__collection').name
+
     def has_duplicate(self, where: Union[Collection, str], query, comparator: Optional[callable] = None) -> bool:
         """
         Check for duplicate items using a query.
@@ -182,6 +335,15 @@ class BaseSpider(scrapy.Spider):
         """
         col = self.get_col(where)
 
+        index = self.dedup_indices.get(col.name)
+        if index is not None and list(query) == [index.key] and index.accepts(query[index.key]):
+            if query[index.key] not in index:
+                return False
+            if index.exact and comparator is None:
+                return True
+
+        # Articles still in the write buffer are not visible to queries.
+        self.flush_articles(col)
         results = col.find(query)
         if results.count() == 0:
             return False
@@ -191,6 +353,69 @@ class BaseSpider(scrapy.Spider):
 
         return any(map(comparator, results))
 
+    def find_duplicates(self, where: Union[Collection, str], key: str, values) -> set:
+        """
+        Check many values of one field for existing documents at once, e.g.
+        all entries of a listing page.
+
+        :param where: The collection to check in.
+        :param key: The field to match.
+        :param values: The values to look up.
+        :return: The set of values that already exist in the collection.
+        """
+        col = self.get_col(where)
+        values = set(values)
+
+        existing = set()
+        index = self.dedup_indices.get(col.name)
+        if index is not None and index.key == key:
+            indexed = set(filter(index.accepts, values))
+            if index.exact:
+                existing = set(filter(index.__contains__, indexed))
+                values -= indexed
+            else:
+                values -= set(x for x in indexed if x not in index)
+
+        if values:
+            self.flush_articles(col)
+            results = col.find({key: {'$in': list(values)}}, projection={key: 1, '_id': 0})
+            existing.update(x[key] for x in results if key in x)
+
+        return existing
+
+    def flush_articles(self, where: Union[Collection, str, None] = None):
+        """
+        Write buffered articles into the database. Call this before querying a
+        collection for articles saved by this crawl.
+
+        :param where: Only flush this collection. If None, flush all of them.
+        """
+        if self.writer is not None:
+            self.writer.flush(None if where is None else self.get_col(where))
+
+    def get_writer(self) -> BufferedWriter:
+        if self.writer is None:
+            self.writer = BufferedWriter(
+                max_docs=self.settings.getint('MONGO_WRITE_BUFFER_SIZE', 100),
+                max_bytes=self.settings.getint('MONGO_WRITE_BUFFER_BYTES', 16 * 1024 * 1024),
+                max_delay=self.settings.getfloat('MONGO_WRITE_BUFFER_SECONDS', 5.),
+                logger=self.logger)
+
+            # Flush on a timer too, so that articles do not wait for the next
+            # save_article() call when a crawl slows down.
+            self._flush_task = task.LoopingCall(self._flush_expired)
+            self._flush_task.start(self.writer.max_delay, now=False)
+        return self.writer
+
+    def _flush_expired(self):
+        # An exception would stop the LoopingCall for the rest of the crawl.
+        # Documents that failed on a connection error stay buffered, and the
+        # next call retries them.
+        try:
+            self.writer.flush_expired()
+        except Exception:
+            self.logger.exception('Failed to flush buffered articles')
+
     def get_col(self, name):
         self.setup_db()
         if isinstance(name, Collection):
@@ -209,31 +434,31 @@ class BaseSpider(scrapy.Spider):
         if self.db is not None:
             return
 
-        self.db = MongoClient(
-            host=self.settings['MONGO_HOSTNAME'],
-        )[self.settings['MONGO_DB']]
-        self.db.authenticate(
-            name=self.settings['MONGO_USERNAME'],
-            password=self.settings['MONGO_PASSWORD'],
-            source=self.settings['MONGO_AUTHENTICATION_DB']
-        )
+        self.db = get_database(self.settings)
 
-        def create_index(col, inds):
-            for index in inds:
-                if not isinstance(index, tuple):
-                    index = (index,)
-
-                col.create_index(*index)
+        registry = get_index_registry(self.settings, self.db)
 
         for name, indices in self.collections_config.items():
             self.collections[name] = self.db[name]
 
-            create_index(self.collections[name], indices)
+            registry.ensure(self.collections[name], indices)
 
         try:
             for name, indices in self.gridfs_config.items():
                 self.gridfs[name] = gridfs.GridFS(self.db, collection=name)
 
-                create_index(getattr(self.gridfs[name], '_GridFS__files'), indices)
+                registry.ensure(getattr(self.gridfs[name], '_GridFS__files'), indices)
         except NotImplementedError:
             pass
+
+        if self.settings.getbool('DEDUP_INDEX_ENABLED', True):
+            for name, key in self.dedup_keys.items():
+                index = DedupIndex(
+                    self.collections[name], key,
+                    bloom_threshold=self.settings.getint('DEDUP_INDEX_BLOOM_THRESHOLD', 1000000))
+                index.load()
+                self.dedup_indices[name] = index
+                self.logger.info('Loaded dedup index on %s.%s (exact: %s)', name, key, index.exact)
+
+        if self.gridfs_config and self.settings.getbool('PDF_CONTENT_DEDUP', True):
+            self.pdf_content_index = get_pdf_content_index(self.settings, self.db)
@@ -1,5 +1,4 @@
 import re
-import time
 
 from datetime import datetime
 import scrapy
@@ -21,8 +20,17 @@ class ArxivSpider(BaseSpider):
             'Publication_Date',
         ],
     }
+    dedup_keys = {
+        'Scraper_arxiv_org': 'Arxiv_id',
+    }
 
-    sleep_time = 5
+    # Wait between the result pages, without blocking other crawls in the same process.
+    # This replaces a 5 second sleep on top of the global DOWNLOAD_DELAY, so it must
+    # not be shorter than both together.
+    custom_settings = {
+        'DOWNLOAD_DELAY': 15,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+    }
 
     def build_query_url(self):
         query_dict = {
@@ -89,10 +97,10 @@ class ArxivSpider(BaseSpider):
         abstracts = [h.xpath('string(span[@class="abstract-full has-text-grey-dark mathjax"])').get() for h in response.xpath('//body//ol[@class="breathe-horizontal"]/li[@class="arxiv-result"]/p[@class="abstract mathjax"]')]
         abstracts = [re.search(r'([^\n\s].*)\n', abstract).group(1) for abstract in abstracts]
 
+        duplicates = self.find_duplicates('Scraper_arxiv_org', 'Arxiv_id', arxiv_ids)
+
         for paper_num in range(0, len(titles)):
-            if not self.has_duplicate(
-                    'Scraper_arxiv_org',
-                    {'Arxiv_id': arxiv_ids[paper_num]}):
+            if arxiv_ids[paper_num] not in duplicates:
                 meta = {}
                 meta['Title'] = titles[paper_num]
                 meta['Journal'] = 'arxiv'
@@ -103,8 +111,6 @@ class ArxivSpider(BaseSpider):
                 meta['Arxiv_id'] = arxiv_ids[paper_num]
                 meta['Abstract'] = abstracts[paper_num]
                 self.save_article(meta, to='Scraper_arxiv_org')
-        print("sleeping for {} seconds".format(self.sleep_time))
-        time.sleep(self.sleep_time)
         try:
             next_page = response.xpath('//body//nav[@class="pagination is-small is-centered breathe-horizontal"]/a[@class="pagination-next"]/@href').extract()[0]
             if next_page is not None:
@@ -26,6 +26,9 @@ class BiorxivSpider(BaseSpider):
     gridfs_config = {
         'Scraper_connect_biorxiv_org_fs': [],
     }
+    dedup_keys = {
+        'Scraper_connect_biorxiv_org': 'Doi',
+    }
 
     pdf_parser_version = 'biorxiv_20200421'
     pdf_laparams = {
@@ -69,7 +72,7 @@ class BiorxivSpider(BaseSpider):
             'biorxiv': self.handle_biorxiv,
         }
 
-        has_paper = False
+        entries = []
         for entry in response.xpath('//div[contains(@class, "highwire-article-citation")]'):
             link = entry.xpath('.//a[contains(@class, "highwire-cite-linked-title")]/@href').extract_first().strip()
             doi = entry.xpath('.//a[contains(@class, "highwire-cite-metadata")]//a/text()').extract_first()
@@ -84,9 +87,14 @@ class BiorxivSpider(BaseSpider):
             else:
                 continue
 
-            if self.has_duplicate(
-                    'Scraper_connect_biorxiv_org',
-                    {'Doi': doi}):
+            entries.append((link, doi, site))
+
+        duplicates = self.find_duplicates(
+            'Scraper_connect_biorxiv_org', 'Doi', [doi for _, doi, _ in entries])
+
+        has_paper = False
+        for link, doi, site in entries:
+            if doi in duplicates:
                 continue
 
             has_paper = True
@@ -111,15 +119,18 @@ class BiorxivSpider(BaseSpider):
     def handle_medrxiv_pdf(self, response):
         result = response.meta
 
-        file_id = self.save_pdf(
+        def save(file_id):
+            result['PDF_gridfs_id'] = file_id
+
+            self.save_article(result, 'Scraper_connect_biorxiv_org')
+
+        d = self.save_pdf(
             pdf_bytes=response.body,
             pdf_fn=result['Doi'].replace('/', '-') + '.pdf',
             pdf_link=result['Link'],
             fs='Scraper_connect_biorxiv_org_fs')
-
-        result['PDF_gridfs_id'] = file_id
-
-        self.save_article(result, 'Scraper_connect_biorxiv_org')
+        d.addCallback(save)
+        return d
 
     def handle_medrxiv(self, response):
         result = response.meta
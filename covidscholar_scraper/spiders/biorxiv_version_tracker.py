@@ -1,10 +1,10 @@
 from urllib.parse import urljoin
 
-import sentry_sdk
 from pymongo import HASHED
 from scrapy import Request
 
 from ._base import BaseSpider
+from ..extensions import NEW_VERSIONS
 
 
 class BiorxivVersionTrackerSpider(BaseSpider):
@@ -71,9 +71,6 @@ class BiorxivVersionTrackerSpider(BaseSpider):
                 'Origin': response.meta['Origin']
             }
 
-            with sentry_sdk.push_scope() as scope:
-                scope.set_extra('DOI', response.meta['Doi'])
-                sentry_sdk.capture_message('Scraper biorxiv: Updating article')
-            sentry_sdk.flush()
+            self.crawler.stats.inc_value(NEW_VERSIONS, spider=self)
 
             self.get_col('Scraper_connect_biorxiv_org_new_versions').insert_one(new_job)
@@ -6,16 +6,17 @@ import validators
 import zipfile
 
 import dateutil.parser
-from PyPDF2.pdf import PdfFileReader, PdfFileWriter
-from PyPDF2.utils import PdfReadError
 from pymongo import HASHED
 from scrapy import Request
+from twisted.internet import defer
 
 from ._base import BaseSpider
 
 
 def pdf_cat(input_files, output_stream):
     """https://stackoverflow.com/questions/3444645/merge-pdf-files"""
+    from PyPDF2.pdf import PdfFileReader, PdfFileWriter
+
     input_streams = []
     try:
         # First open all the files, then produce the output file, and
@@ -36,6 +37,8 @@ def pdf_cat(input_files, output_stream):
 
 
 def extract_zip_as_single_pdf(zip_data):
+    from PyPDF2.utils import PdfReadError
+
     f = io.BytesIO(zip_data)
     z = zipfile.ZipFile(file=f)
     pdf_stream = []
@@ -141,32 +144,35 @@ class ChemrxivSpider(BaseSpider):
                 )
 
     def update_article(self, article, pdf_data=None, pdf_link=None):
+        def save(file_id):
+            article['PDF_gridfs_id'] = file_id
+            self.save_article(article, to='Scraper_chemrxiv_org')
+
         if pdf_data is not None:
-            file_id = self.save_pdf(
+            d = self.save_pdf(
                 pdf_bytes=pdf_data,
                 pdf_fn=article['Doi'].replace('/', '-') + '.pdf',
                 pdf_link=pdf_link,
                 fs='Scraper_chemrxiv_org_fs',
             )
         else:
-            file_id = None
-
-        article['PDF_gridfs_id'] = file_id
-        self.save_article(article, to='Scraper_chemrxiv_org')
+            d = defer.succeed(None)
+        d.addCallback(save)
+        return d
 
     def handle_zip_or_pdf(self, response):
         if response.headers['Content-Type'] == b'application/pdf':
-            self.update_article(
+            return self.update_article(
                 response.meta,
                 pdf_data=response.body,
                 pdf_link=response.request.url)
         elif response.headers['Content-Type'] == b'application/zip':
-            self.update_article(
+            return self.update_article(
                 response.meta,
                 pdf_data=extract_zip_as_single_pdf(response.body),
                 pdf_link=response.request.url)
         else:
-            self.update_article(response.meta)
+            return self.update_article(response.meta)
 
     def parse_article(self, response):
         meta = response.meta
@@ -3,7 +3,6 @@ import re
 from datetime import datetime
 from urllib.parse import urljoin
 
-import pandas
 from pymongo import HASHED
 from scrapy import Request
 
@@ -36,6 +35,8 @@ class ChictrSpider(BaseSpider):
         )
 
     def parse_xlsx(self, response):
+        import pandas
+
         file = io.BytesIO(response.body)
         table = pandas.read_excel(file)
 
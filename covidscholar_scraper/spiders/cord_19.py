@@ -6,8 +6,6 @@ import tarfile
 import time
 from datetime import datetime, timedelta
 
-import numpy as np
-import pandas as pd
 from pymongo import HASHED
 from scrapy import Request
 
@@ -27,6 +25,8 @@ def correct_pd_dict(input_dict):
         output_dict : new dictionary with (hopefully) corrected encodings
     """
 
+    import numpy as np
+
     output_dict = {}
     for key1, val1 in input_dict.items():
         # Nested dictionaries
@@ -129,6 +129,7 @@ class Cord19Spider(BaseSpider):
             time.sleep(3)
 
     def parse_csv(self, response):
+        import pandas as pd
 
         fileio = io.StringIO(response.body.decode('utf-8'))
 
@@ -151,6 +152,7 @@ class Cord19Spider(BaseSpider):
 
             insert = True
 
+            self.flush_articles(collection)
             old_docs = collection.find({'cord_uid': data['cord_uid']}).sort('last_updated', -1)
             for old_doc in old_docs:
                 old_doc = {x: old_doc.get(x, None) for x in data}
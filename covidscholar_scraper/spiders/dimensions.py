@@ -1,7 +1,8 @@
-import pandas as pd
-from pymongo import MongoClient, HASHED
+from pymongo import HASHED
 import scrapy
 
+from ..db import get_database, get_index_registry
+
 
 class DimensionCOVIDScraper(scrapy.Spider):
     name = "dimensions"
@@ -29,14 +30,7 @@ class DimensionCOVIDScraper(scrapy.Spider):
         """
         Setup database and collection. Ensure indices.
         """
-        self.db = MongoClient(
-            host=self.settings['MONGO_HOSTNAME'],
-        )[self.settings['MONGO_DB']]
-        self.db.authenticate(
-            name=self.settings['MONGO_USERNAME'],
-            password=self.settings['MONGO_PASSWORD'],
-            source=self.settings['MONGO_AUTHENTICATION_DB']
-        )
+        self.db = get_database(self.settings)
 
     def start_requests(self):
         self.setup_db()
@@ -75,11 +69,12 @@ class DimensionCOVIDScraper(scrapy.Spider):
         for sheet_name, collection_name, entries, keys in \
                 zip(self.sheet_names, self.collection_names, self.entries, self.query_keys):
             collection = self.db[collection_name]
-            for entry in entries:
-                collection.create_index([entry])
+            get_index_registry(self.settings, self.db).ensure(collection, [[entry] for entry in entries])
             self.parse_sheet(table, sheet_name, collection, keys)
 
     def parse_sheet(self, table, sheet_name, collection, keys):
+        import pandas as pd
+
         sheet = pd.read_excel(table, sheet_name=sheet_name, parse_dates=[0], na_filter=False)
         indexes = [index.lower().replace(" ", "_") for index in sheet.columns]
         for row in sheet.values:
@@ -94,5 +89,7 @@ class DimensionCOVIDScraper(scrapy.Spider):
 
     @staticmethod
     def date_parser(date: str):
+        import pandas as pd
+
         print(date)
         return pd.to_datetime(date, format("%Y-%m-%d")).date()
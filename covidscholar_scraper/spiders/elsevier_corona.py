@@ -5,7 +5,6 @@ import time
 from datetime import datetime
 from io import BytesIO
 
-import pysftp
 from pymongo import HASHED
 from pymongo.errors import DocumentTooLarge
 
@@ -125,6 +124,8 @@ class ElsevierCoronaSpider(BaseSpider):
     def start_requests(self):
         self.setup_db()
 
+        import pysftp
+
         cnopts = pysftp.CnOpts()
         cnopts.hostkeys = None
         with pysftp.Connection(
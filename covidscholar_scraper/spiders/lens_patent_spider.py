@@ -19,6 +19,9 @@ class PatentSpider(BaseSpider):
             'Published_Date',
         ]
     }
+    dedup_keys = {
+        'Scraper_lens_patents': 'Lens_ID',
+    }
 
     @staticmethod
     def build_lens_url(kwargs, from_i=0):
@@ -65,6 +68,9 @@ class PatentSpider(BaseSpider):
     def parse(self, response):
         data = json.loads(response.text)
 
+        duplicates = self.find_duplicates(
+            'Scraper_lens_patents', 'Lens_ID', [patent['lensId'] for patent in data['hits']])
+
         for patent in data['hits']:
             publication_number = patent['displayKey']
             lens_id = patent['lensId']
@@ -77,9 +83,7 @@ class PatentSpider(BaseSpider):
 
             abstract_link = "https://www.lens.org/lens/patent/%s" % (lens_id,)
 
-            if self.has_duplicate(
-                    where='Scraper_lens_patents',
-                    query={'Lens_ID': lens_id}):
+            if lens_id in duplicates:
                 continue
 
             yield scrapy.Request(
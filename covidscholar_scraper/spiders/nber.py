@@ -40,17 +40,19 @@ class NBERSpider(BaseSpider):
 
     def parse_all_links(self, response):
         data = json.loads(response.body)
-        has_dup = False
+        articles = []
         for result in data['results']:
             m = re.match(r'/papers/(.+)$', result['url'])
             if not m:
                 continue
+            articles.append((m.group(1), f'https://www.nber.org{result["url"]}'))
+
+        duplicates = self.find_duplicates(
+            'Scraper_nber_org', 'NBER_Article_Number', [x for x, _ in articles])
 
-            article_number = m.group(1)
-            url = f'https://www.nber.org{result["url"]}'
-            if not self.has_duplicate(
-                    'Scraper_nber_org',
-                    {'NBER_Article_Number': article_number}):
+        has_dup = False
+        for article_number, url in articles:
+            if article_number not in duplicates:
                 yield Request(
                     url=url,
                     callback=self.parse_page,
@@ -106,11 +108,14 @@ class NBERSpider(BaseSpider):
     def handle_pdf(self, response):
         data = response.meta['Data']
 
-        pdf_id = self.save_pdf(
+        def save(pdf_id):
+            data['PDF_gridfs_id'] = pdf_id
+            self.save_article(data, to='Scraper_nber_org')
+
+        d = self.save_pdf(
             response.body,
             pdf_fn=f'NBER-{data["NBER_Article_Number"]}.pdf',
             pdf_link=response.request.url,
             fs='Scraper_nber_org_fs')
-
-        data['PDF_gridfs_id'] = pdf_id
-        self.save_article(data, to='Scraper_nber_org')
+        d.addCallback(save)
+        return d
@@ -104,12 +104,15 @@ class PrePrintsOrgSpider(BaseSpider):
     def handle_pdf(self, response):
         result = response.meta
 
-        file_id = self.save_pdf(
+        def save(file_id):
+            result['PDF_gridfs_id'] = file_id
+
+            self.save_article(result, 'Scraper_preprints_org')
+
+        d = self.save_pdf(
             pdf_bytes=response.body,
             pdf_fn=result['Doi'].replace('/', '-') + '.pdf',
             pdf_link=result['PDF_Link'],
             fs='Scraper_preprints_org_fs')
-
-        result['PDF_gridfs_id'] = file_id
-
-        self.save_article(result, 'Scraper_preprints_org')
+        d.addCallback(save)
+        return d
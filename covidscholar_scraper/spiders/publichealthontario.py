@@ -40,14 +40,18 @@ class PublichealthontarioSpider(BaseSpider):
             callback=self.parse)
 
     def save_object(self, result):
-        result['PDF_gridfs_id'] = self.save_pdf(
+        def save(file_id):
+            result['PDF_gridfs_id'] = file_id
+            self.save_article(result, to='Scraper_publichealthontario')
+
+        d = self.save_pdf(
             pdf_bytes=result['pdf_bytes'],
             pdf_fn=re.sub(r'[^a-zA-Z0-9]', '-', result['Title']) + '.pdf',
             pdf_link=result['Link'],
             fs='Scraper_publichealthontario_fs')
         del result['pdf_bytes']
-
-        self.save_article(result, to='Scraper_publichealthontario')
+        d.addCallback(save)
+        return d
 
     @staticmethod
     def find_abstract_by_parsing(content):
@@ -94,7 +98,7 @@ class PublichealthontarioSpider(BaseSpider):
             abstract = None
 
         meta['Abstract'] = abstract
-        self.save_object(meta)
+        return self.save_object(meta)
 
     def handle_pdf(self, response):
         meta = response.meta
@@ -158,6 +162,7 @@ class PublichealthontarioSpider(BaseSpider):
             if synopsis is None:
                 continue
 
+            self.flush_articles('Scraper_publichealthontario')
             old_items = self.get_col('Scraper_publichealthontario').find({'Link': link})
             insert = True
             for item in old_items:
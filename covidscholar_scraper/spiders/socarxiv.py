@@ -6,6 +6,7 @@ import scrapy
 from pymongo import HASHED
 from scrapy import Request
 from scrapy.http import JsonRequest
+from twisted.internet import defer
 
 from ._base import BaseSpider
 
@@ -94,18 +95,22 @@ class SocarxivSpider(BaseSpider):
         pdf_data = response.body
         pdf_link = response.request.url
         article = response.meta
+
+        def save(file_id):
+            article['PDF_gridfs_id'] = file_id
+            self.save_article(article, to='Scraper_share_osf_io_socarxiv')
+
         if pdf_data is not None:
-            file_id = self.save_pdf(
+            d = self.save_pdf(
                 pdf_bytes=pdf_data,
                 pdf_fn=article['Doi'].replace('/', '-') + '.pdf',
                 pdf_link=pdf_link,
                 fs='Scraper_share_osf_io_socarxiv_fs',
             )
         else:
-            file_id = None
-
-        article['PDF_gridfs_id'] = file_id
-        self.save_article(article, to='Scraper_share_osf_io_socarxiv')
+            d = defer.succeed(None)
+        d.addCallback(save)
+        return d
 
     def parse_article(self, response):
         meta = response.meta
@@ -48,15 +48,21 @@ class BaseSsrnSpider(BaseSpider):
     def parse_query_result(self, response):
         papers = response.xpath(
             "//div[contains(@class, 'papers-list')]//div[contains(@class, 'description')]")
-        has_new_papers = False
+        urls = []
         for paper in papers:
             url = paper.xpath('.//a[contains(@class, "title")]/@href').extract_first()
-            url = urljoin(response.request.url, url)
+            urls.append(urljoin(response.request.url, url))
+
+        def url_to_doi(u):
+            paper_id = re.search(r'abstract_id=(\d+)', u).group(1)
+            return "10.2139/ssrn.%s" % paper_id
 
-            paper_id = re.search(r'abstract_id=(\d+)', url).group(1)
-            if self.has_duplicate(
-                    'Scraper_papers_ssrn_com',
-                    {'Doi': "10.2139/ssrn.%s" % paper_id}):
+        duplicates = self.find_duplicates(
+            'Scraper_papers_ssrn_com', 'Doi', map(url_to_doi, urls))
+
+        has_new_papers = False
+        for url in urls:
+            if url_to_doi(url) in duplicates:
                 continue
 
             has_new_papers = True
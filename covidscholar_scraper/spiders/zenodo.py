@@ -19,6 +19,9 @@ class ZenodoSpider(BaseSpider):
             'last_updated'
         ]
     }
+    dedup_keys = {
+        'Scraper_zenodo_org': 'doi',
+    }
 
     start_urls = ['https://zenodo.org/api/records/?page=1&size=20&communities=covid-19']
 
@@ -28,11 +31,12 @@ class ZenodoSpider(BaseSpider):
         except JSONDecodeError:
             return
 
+        duplicates = self.find_duplicates(
+            'Scraper_zenodo_org', 'doi', [item['doi'] for item in data['hits']['hits']])
+
         has_new_element = False
         for item in data['hits']['hits']:
-            if self.has_duplicate(
-                    where='Scraper_zenodo_org',
-                    query={'doi': item['doi']}):
+            if item['doi'] in duplicates:
                 continue
 
             has_new_element = True
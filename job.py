@@ -1,7 +1,17 @@
+import hashlib
+import heapq
+import itertools
 import os
+import random
+import shlex
+import signal
+import subprocess
+import sys
 import tempfile
+import threading
 import time
-import urllib.request
+import traceback
+from datetime import datetime
 from threading import Thread
 
 from pip._internal.commands.install import InstallCommand
@@ -9,7 +19,16 @@ from pip._internal.commands.install import InstallCommand
 current_dir = os.path.realpath(os.path.dirname(__file__))
 os.chdir(current_dir)
 
-wheels_base = 'https://github.com/COVID-19-Text-Mining/scrapers/raw/master/wheels/'
+# The wheelhouse. Startup installs wheels from it whose SHA-256 is listed in
+# wheels/SHA256SUMS. "python job.py --update-wheelhouse" adds missing wheels
+# and their hashes.
+wheels_dir = os.path.join(current_dir, 'wheels')
+wheel_hashes_fn = os.path.join(wheels_dir, 'SHA256SUMS')
+# Everything the wheelhouse does not provide is installed from the package
+# index, pinned to the versions and hashes in this file.
+lock_fn = os.path.join(current_dir, 'requirements-lock.txt')
+# Wheels built for the image. Those missing from the wheelhouse are built
+# from the pinned sources in the lock file instead.
 wheels = [
     "bcrypt-3.1.7-cp36-cp36m-linux_x86_64.whl",
     "cffi-1.14.0-cp36-cp36m-linux_x86_64.whl",
@@ -29,102 +48,734 @@ wheels = [
     "zope.interface-5.1.0-cp36-cp36m-linux_x86_64.whl",
 ]
 
+# Job command => interval in seconds, or a dict with the "interval" and options:
+#   mode: "subprocess" to always run the job in its own process.
+#   cost: "light_api" (default), "pdf_cpu" or "heavy_io", see JOB_CONCURRENCY.
+#   exclusive: Name of a group of jobs that must not run at the same time.
+#   min_interval, max_interval: Bounds of the adaptive interval, see JOB_INTERVAL_BOUNDS.
+#   adaptive: False to always use "interval".
+#   budget: Maximum runtime in seconds (default JOB_DEFAULT_BUDGET), or None.
+#   after: Jobs that trigger this job right away when they finish with new items.
+#   watch: Collections that trigger this job right away when they get new documents.
+#   probe: Name of a probe in covidscholar_scraper.probes. The probe runs every
+#       probe_interval seconds (default JOB_PROBE_INTERVAL), and the crawl only
+#       runs when the probe result changed, or after max_interval without a crawl.
 jobs_registry = {
-    'scrapy crawl osf_org': 3600,
-    'scrapy crawl preprints_org': 3600,
-    'scrapy crawl email': 3600,
-    'scrapy crawl zenodo': 3600,
+    'scrapy crawl osf_org': {'interval': 3600, 'cost': 'pdf_cpu', 'exclusive': 'osf'},
+    'scrapy crawl preprints_org': {'interval': 3600, 'cost': 'pdf_cpu', 'probe': 'preprints_org'},
+    # IMAP and SFTP sessions can hang, keep them isolated.
+    'scrapy crawl email': {'interval': 3600, 'mode': 'subprocess', 'budget': 1800},
+    'scrapy crawl zenodo': {'interval': 3600, 'probe': 'zenodo'},
     'scrapy crawl engrxiv': 3600,
     'scrapy crawl retraction_database': 3600 * 6,
     # 'scrapy crawl chictr': 3600 * 12,
-    'scrapy crawl biorxiv': 3600,
-    'scrapy crawl cord_19': 3600 * 12,
-    'scrapy crawl chemrxiv': 3600,
-    # 'scrapy crawl publichealthontario': 3600,
-    'scrapy crawl elsevier_corona': 3600,
-    'scrapy crawl lens_patent_spider': 3600,
-    'scrapy crawl biorxiv_version_tracker': 86400,
-    'scrapy crawl psyarxiv': 3600 * 6,
+    'scrapy crawl biorxiv': {
+        'interval': 3600, 'cost': 'pdf_cpu', 'exclusive': 'biorxiv',
+        # Ingest the updates found by biorxiv_version_tracker.
+        'after': ['scrapy crawl biorxiv_version_tracker'],
+        'watch': ['Scraper_connect_biorxiv_org_new_versions'],
+    },
+    # cord_19 sleeps between inserts and biorxiv_version_tracker scans a whole
+    # collection in start_requests, both on the reactor thread. Keep them from
+    # stalling the in-process crawls.
+    'scrapy crawl cord_19': {'interval': 3600 * 12, 'mode': 'subprocess', 'cost': 'heavy_io', 'budget': 3600 * 6},
+    'scrapy crawl chemrxiv': {'interval': 3600, 'cost': 'pdf_cpu', 'probe': 'chemrxiv'},
+    # 'scrapy crawl publichealthontario': {'interval': 3600, 'cost': 'pdf_cpu'},
+    'scrapy crawl elsevier_corona': {'interval': 3600, 'mode': 'subprocess', 'cost': 'heavy_io', 'budget': 1800},
+    'scrapy crawl lens_patent_spider': {'interval': 3600, 'probe': 'lens'},
+    'scrapy crawl biorxiv_version_tracker': {'interval': 86400, 'mode': 'subprocess', 'exclusive': 'biorxiv'},
+    'scrapy crawl psyarxiv': {'interval': 3600 * 6, 'cost': 'pdf_cpu', 'exclusive': 'osf'},
     'scrapy crawl thelancet': 3600 * 6,
     'scrapy crawl arxiv': 3600 * 12,
-    'scrapy crawl socarxiv': 3600 * 6,
+    'scrapy crawl socarxiv': {'interval': 3600 * 6, 'cost': 'pdf_cpu', 'exclusive': 'osf'},
     'scrapy crawl ssrn': 3600 * 12,
-    'scrapy crawl nber': 3600 * 1,
+    'scrapy crawl nber': {'interval': 3600 * 1, 'cost': 'pdf_cpu', 'probe': 'nber'},
 }
 
+# Maximum number of jobs of each cost class that run at the same time.
+# Due jobs that do not fit wait until a job of their class finishes.
+JOB_CONCURRENCY = {
+    'heavy_io': 1,
+    'pdf_cpu': 2,
+    'light_api': 4,
+}
+
+# The interval of a job is halved after runs that found new items, and
+# doubled after runs that found nothing, between these multiples of its
+# registered interval (unless the job sets min_interval/max_interval).
+JOB_INTERVAL_BOUNDS = (0.25, 8)
+
+# Up to this many seconds of random delay are added to every scheduled run.
+JOB_JITTER = 300
+
+# Jobs running longer than their budget get SIGTERM (in-process crawls are
+# stopped), and SIGKILL if they still run JOB_KILL_GRACE seconds later.
+# In-process crawls cannot be killed: one that does not stop keeps its job
+# running until it does. Jobs that can hang should use mode "subprocess".
+JOB_DEFAULT_BUDGET = 3600 * 3
+JOB_KILL_GRACE = 120
+
+# Seconds between the probes of jobs that have one.
+JOB_PROBE_INTERVAL = 300
+
+# Seconds between checks of the collections that jobs watch.
+JOB_WATCH_INTERVAL = 30
+
+# Jobs that became due while the scheduler was down are started this many
+# seconds apart after a restart, most overdue first.
+JOB_CATCHUP_STAGGER = 60
+
+# "process": run spiders inside this process (see covidscholar_scraper.runner),
+# sharing the Mongo connections and PDF workers between runs.
+# "subprocess": start every job as a separate command.
+JOB_RUN_MODE = os.environ.get('JOB_RUN_MODE', 'process')
+
+
+def wheel_version(wheel):
+    """(name, version) from a wheel filename."""
+    name, version = wheel.split('-')[:2]
+    return name, version
+
+
+def is_installed(name, version=None):
+    import pkg_resources
+
+    try:
+        dist = pkg_resources.get_distribution(name)
+    except pkg_resources.DistributionNotFound:
+        return False
+    return version is None or dist.version == version
+
+
+def requirements_satisfied(fn='requirements.txt'):
+    import pkg_resources
+
+    with open(fn) as f:
+        requirements = [x.strip() for x in f if x.strip() and not x.startswith('#')]
+    try:
+        pkg_resources.require(requirements)
+    except (pkg_resources.DistributionNotFound, pkg_resources.VersionConflict):
+        return False
+    return True
+
+
+def read_wheel_hashes():
+    """{wheel filename: SHA-256} from wheels/SHA256SUMS, empty if it does not exist."""
+    hashes = {}
+    if not os.path.exists(wheel_hashes_fn):
+        return hashes
+    with open(wheel_hashes_fn) as f:
+        for line in f:
+            if line.strip():
+                digest, fn = line.split()
+                hashes[fn] = digest
+    return hashes
+
+
+def sha256_file(fn):
+    digest = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def verify_wheelhouse(hashes):
+    """Problems that prevent installing from the wheelhouse, as messages."""
+    problems = []
+    for fn, digest in sorted(hashes.items()):
+        path = os.path.join(wheels_dir, fn)
+        if not os.path.exists(path):
+            problems.append(f'{fn} is listed in SHA256SUMS, but missing from {wheels_dir}')
+        elif sha256_file(path) != digest:
+            problems.append(f'SHA-256 mismatch for {fn}')
+    problems += [f'{fn} is not listed in SHA256SUMS' for fn in sorted(os.listdir(wheels_dir))
+                 if fn.endswith('.whl') and fn not in hashes]
+    return problems
+
+
+def pip_install(args):
+    """Run pip install in this process. Returns its exit status."""
+    # A command keeps the options of its previous run, so every run gets a new one.
+    return InstallCommand('install', 'install packages').main(args)
+
 
 def install_pip():
-    temp_dir = tempfile.gettempdir()
-    wheel_fn = []
-    for wheel in wheels:
-        fn = os.path.join(temp_dir, wheel)
+    """
+    Install the packages that are not installed at their version yet: first
+    the wheels of the local wheelhouse, without network access, and then
+    the rest of requirements-lock.txt from the package index. pip checks
+    every file against the hashes in wheels/SHA256SUMS and
+    requirements-lock.txt. Fails if a wheel does not match, or if
+    requirements.txt is not satisfied afterwards.
+    """
+    started = time.time()
+    if all(is_installed(*wheel_version(wheel)) for wheel in wheels) and requirements_satisfied():
+        print(f'All packages are installed, checked in {time.time() - started:.1f} seconds.')
+        return
 
-        print(f'{wheels_base + wheel} => {fn}')
-        urllib.request.urlretrieve(wheels_base + wheel, fn)
+    hashes = read_wheel_hashes()
+    problems = verify_wheelhouse(hashes)
+    if problems:
+        for problem in problems:
+            print(problem)
+        print('Refusing to install from the wheelhouse. Fix the wheels and their hashes with '
+              '"python job.py --update-wheelhouse".')
+        exit(1)
+
+    missing = [wheel for wheel in wheels if wheel not in hashes]
+    if missing:
+        print(f'Not in the wheelhouse, installing from the package index instead: {", ".join(missing)}')
 
-        wheel_fn.append(fn)
+    pinned = []
+    for fn, digest in sorted(hashes.items()):
+        name, version = wheel_version(fn)
+        if not is_installed(name, version):
+            pinned.append(f'{name}=={version} --hash=sha256:{digest}\n')
 
-    install_cmd = InstallCommand('install', 'install packages')
-    if install_cmd.main(wheel_fn) or install_cmd.main(['-r', 'requirements.txt']):
+    with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+        f.writelines(pinned)
+        f.flush()
+        # The lock file pins the dependencies, so pip need not resolve any.
+        if pinned and pip_install(
+                ['--no-index', '--find-links', wheels_dir, '--require-hashes', '--no-deps', '-r', f.name]):
+            print('Failed to execute pip install.')
+            exit(1)
+
+    # Packages installed from the wheelhouse are skipped, they have the versions of the lock file.
+    from_index = bool(missing) or not requirements_satisfied()
+    if from_index and pip_install(['--require-hashes', '--no-deps', '-r', lock_fn]):
         print('Failed to execute pip install.')
         exit(1)
 
-    for wheel in wheel_fn:
-        print(f'Removing {wheel}')
-        os.unlink(wheel)
+    if not requirements_satisfied():
+        print('requirements.txt is not satisfied by requirements-lock.txt. Regenerate it with '
+              '"pip-compile --generate-hashes" under Python 3.6.')
+        exit(1)
+
+    print(f'Installed {len(pinned)} wheels from the wheelhouse{" and the package index" if from_index else ""} '
+          f'in {time.time() - started:.1f} seconds.')
+
+
+def update_wheelhouse():
+    """
+    Build or download the wheels of requirements.txt and of ``wheels`` that
+    are missing from the wheelhouse, with their dependencies, and add the
+    hashes of the new wheels to wheels/SHA256SUMS. Needs network access, and
+    the build dependencies in the Dockerfile to build wheels for the image.
+    Review and commit the new wheels.
+    """
+    hashes = read_wheel_hashes()
+    requirements = ['{}=={}'.format(*wheel_version(wheel)) for wheel in wheels]
+    if subprocess.run([sys.executable, '-m', 'pip', 'wheel', '--wheel-dir', wheels_dir, '--find-links', wheels_dir,
+                       '-r', 'requirements.txt'] + requirements).returncode:
+        print('Failed to execute pip wheel.')
+        exit(1)
+
+    added = [fn for fn in sorted(os.listdir(wheels_dir)) if fn.endswith('.whl') and fn not in hashes]
+    with open(wheel_hashes_fn, 'a') as f:
+        for fn in added:
+            f.write(f'{sha256_file(os.path.join(wheels_dir, fn))}  {fn}\n')
+    print(f'Added {len(added)} wheels to the wheelhouse: {", ".join(added) or "none"}.')
+
+
+def load_job_history():
+    """The JobHistory of the project settings, or None if the database is unavailable."""
+    try:
+        from covidscholar_scraper.job_history import get_job_history
+        from scrapy.utils.project import get_project_settings
+
+        return get_job_history(get_project_settings())
+    except Exception:
+        traceback.print_exc()
+        print('Job history is unavailable, intervals will not adapt to it.')
+        return None
+
+
+def load_database():
+    """The database of the project settings, or None if it is unavailable."""
+    try:
+        from covidscholar_scraper.db import get_database
+        from scrapy.utils.project import get_project_settings
+
+        return get_database(get_project_settings())
+    except Exception:
+        traceback.print_exc()
+        print('Database is unavailable, watched collections will not trigger jobs.')
+        return None
+
+
+def load_job_state():
+    """The JobState of the project settings, or None if the database is unavailable."""
+    try:
+        from covidscholar_scraper.job_history import get_job_state
+        from scrapy.utils.project import get_project_settings
+
+        state = get_job_state(get_project_settings())
+        state.load()
+        return state
+    except Exception:
+        traceback.print_exc()
+        print('Job state is unavailable, all jobs start on a new schedule.')
+        return None
+
+
+class Job(object):
+    def __init__(self, name, spec):
+        if not isinstance(spec, dict):
+            spec = {'interval': spec}
+
+        self.name = name
+        self.interval = spec['interval']
+        self.mode = spec.get('mode')
+        self.cost = spec.get('cost', 'light_api')
+        self.exclusive = spec.get('exclusive')
+        self.adaptive = spec.get('adaptive', True)
+        self.budget = spec.get('budget', JOB_DEFAULT_BUDGET)
+        self.after = spec.get('after', [])
+        self.watch = spec.get('watch', [])
+        # Set when the job is triggered while it runs, so that it runs again when it finishes.
+        self.triggered = False
+        self.probe = spec.get('probe')
+        self.probe_interval = spec.get('probe_interval', JOB_PROBE_INTERVAL)
+        # The probe result of the last successful crawl, and when the last crawl started.
+        self.probe_result = {}
+        self.last_crawl = None
+        self.min_interval = spec.get('min_interval', self.interval * JOB_INTERVAL_BOUNDS[0])
+        self.max_interval = spec.get('max_interval', self.interval * JOB_INTERVAL_BOUNDS[1])
+        self.current_interval = self.interval
+        self.next_run = None
+        self.thread = None
+        # Bumped whenever the job is re-scheduled or removed, which
+        # invalidates its older entries in the queue.
+        self.version = 0
+
+    @property
+    def spider(self):
+        """The spider name if the job is "scrapy crawl <spider>", otherwise None."""
+        parts = self.name.split()
+        if len(parts) == 3 and parts[:2] == ['scrapy', 'crawl']:
+            return parts[2]
+        return None
+
+    def adapt(self, run):
+        """Shorten the interval after a run that found new items, back off after one that found nothing."""
+        if not self.adaptive or run.get('status') != 0 or run.get('new_items') is None:
+            return
+
+        if run['new_items'] > 0:
+            self.current_interval = max(self.min_interval, self.current_interval / 2)
+        else:
+            self.current_interval = min(self.max_interval, self.current_interval * 2)
+
+    @property
+    def next_interval(self):
+        return self.probe_interval if self.probe else self.current_interval
 
 
 class Scheduler(object):
-    def __init__(self, jobs):
-        self.jobs = jobs.copy()
-        self.timer = jobs.copy()
-        self.running = {name: None for name in jobs}
-
-        for job in jobs:
-            self.reset_job(job)
-
-    def poll_jobs(self):
-        for name in self.running:
-            if self.running[name] is not None:
-                if self.running[name].is_alive():
-                    # Push back execution
-                    self.timer[name] = self.jobs[name]
-                else:
-                    self.running[name].join()
-                    print(f'Job {name} finished.')
-                    self.running[name] = None
+    """
+    Runs every job in its own thread, ``interval`` seconds after its previous
+    run finished, plus a random delay of up to ``jitter`` seconds so that
+    jobs with the same interval do not start at the same moment.
+
+    Pending runs are kept in a heap ordered by their start time, and the
+    scheduler sleeps until the first one is due, or until jobs are added,
+    removed or finished.
+
+    In "process" mode, spiders run in a long-lived reactor in this process,
+    except jobs with mode "subprocess" and jobs that are not spiders.
+
+    At most ``concurrency[cost]`` jobs of a cost class, and one job of an
+    exclusive group, run at the same time. Due jobs that do not fit are
+    queued, and started in order once they fit.
+
+    Every run is recorded in ``history`` (a JobHistory), and the number of
+    new items it found adapts the interval of the job (see Job.adapt()).
+
+    The next run and interval of every job are saved in ``state`` (a
+    JobState). On startup, jobs resume their saved schedule, and overdue
+    jobs run right away, ``catchup_stagger`` seconds apart.
+
+    Runs longer than the budget of their job are terminated, and killed if
+    they do not exit within ``kill_grace`` seconds. An in-process crawl
+    that does not stop is recorded as abandoned, and its job counts as
+    running until the crawl stops, even if the job is removed meanwhile.
+
+    A job runs right away when a job in its "after" list finishes with new
+    items, or when a collection in its "watch" list (in ``db``) grows.
+    """
+
+    def __init__(self, jobs, jitter=JOB_JITTER, mode=JOB_RUN_MODE, concurrency=None, history=None,
+                 state=None, catchup_stagger=JOB_CATCHUP_STAGGER, kill_grace=JOB_KILL_GRACE,
+                 db=None, watch_interval=JOB_WATCH_INTERVAL):
+        self.jitter = jitter
+        self.db = db
+        self.watch_interval = watch_interval
+        self.kill_grace = kill_grace
+        self.history = history
+        self.state = state
+        self.catchup_stagger = catchup_stagger
+        self.mode = mode
+        self.concurrency = JOB_CONCURRENCY if concurrency is None else concurrency
+        self.jobs = {}
+        self.waiting = []
+        # Jobs whose run has not finished yet, including removed jobs.
+        self.runs = set()
+        self._runner = None
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+        self.resume(jobs)
+
+    def resume(self, jobs):
+        """Add the jobs on their saved schedule, and stagger those that are overdue."""
+        saved = self.load_state()
+        now = time.time()
+
+        overdue = []
+        for name, spec in jobs.items():
+            job = Job(name, spec)
+            record = saved.get(name, {})
+            if 'interval' in record:
+                job.current_interval = min(max(record['interval'], job.min_interval), job.max_interval)
+            job.probe_result = record.get('probe') or {}
+            if record.get('last_run_start') is not None:
+                job.last_crawl = record['last_run_start'].timestamp()
+
+            next_run = record.get('next_run')
+            next_run = next_run.timestamp() if next_run is not None else None
+            if next_run is not None and next_run > now:
+                self._add(job, next_run - now, jitter=False)
+            else:
+                # Jobs that never ran go last.
+                overdue.append((next_run if next_run is not None else float('inf'), job))
+
+        overdue.sort(key=lambda x: x[0])
+        for i, (_, job) in enumerate(overdue):
+            self._add(job, i * self.catchup_stagger, jitter=False)
+
+    def load_state(self) -> dict:
+        if self.state is None:
+            return {}
+        try:
+            return self.state.load()
+        except Exception:
+            traceback.print_exc()
+            return {}
+
+    def save_state(self, job, **fields):
+        if self.state is None:
+            return
+        try:
+            self.state.save(
+                job.name, interval=job.current_interval, next_run=datetime.fromtimestamp(job.next_run), **fields)
+        except Exception:
+            traceback.print_exc()
+
+    def add_job(self, name, spec, delay=None):
+        """
+        Add a job. It first runs after ``delay`` seconds (default: its interval), plus jitter.
+
+        :param name: The command.
+        :param spec: The interval in seconds, or a dict as in jobs_registry.
+        """
+        job = Job(name, spec)
+        self._add(job, job.interval if delay is None else delay)
+
+    def _add(self, job, delay, jitter=True):
+        with self._cond:
+            if job.name in self.jobs:
+                raise ValueError(f'Job "{job.name}" already exists')
+            self.jobs[job.name] = job
+            self.schedule(job, delay, jitter=jitter)
+        self.save_state(job)
+
+    def remove_job(self, name):
+        """Remove a job. If it is running, it finishes but does not run again."""
+        with self._cond:
+            job = self.jobs.pop(name)
+            job.version += 1
+            if job in self.waiting:
+                self.waiting.remove(job)
+            self._cond.notify()
+        print(f'Removed job "{name}"')
+
+    def schedule(self, job, delay, jitter=True):
+        with self._cond:
+            job.version += 1
+            if jitter:
+                delay += random.uniform(0, self.jitter)
+            job.next_run = time.time() + delay
+            heapq.heappush(self._queue, (job.next_run, next(self._counter), job.name, job.version))
+            self._cond.notify()
+        print(f'Scheduling job "{job.name}" to be run in {delay:.0f} seconds...')
+
+    def next_due(self):
+        """
+        Pop the first due job. Returns (job, None), or (None, seconds until
+        the next job is due), or (None, None) if nothing is scheduled.
+        """
+        while self._queue:
+            next_run, _, name, version = self._queue[0]
+            job = self.jobs.get(name)
+            if job is None or job.version != version:
+                heapq.heappop(self._queue)
+                continue
+
+            wait = next_run - time.time()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self._queue)
+            return job, None
+        return None, None
+
+    def running(self):
+        """The jobs that are running, including removed jobs whose run has not finished."""
+        return list(self.runs)
 
-    def reset_job(self, name):
-        print(f'Scheduling job "{name}" to be run in {self.jobs[name]} seconds...')
-        self.timer[name] = self.jobs[name]
+    def fits(self, job):
+        """
+        Whether the job can start now without exceeding its class limit or
+        exclusive group, and no earlier run of a job with its name still runs.
+        """
+        running = self.running()
+        if any(x.name == job.name for x in running):
+            return False
+        if sum(x.cost == job.cost for x in running) >= self.concurrency.get(job.cost, 1):
+            return False
+        if job.exclusive is not None and any(x.exclusive == job.exclusive for x in running):
+            return False
+        return True
+
+    def start_waiting(self):
+        for job in list(self.waiting):
+            if self.fits(job):
+                self.waiting.remove(job)
+                self.start_job(job)
+
+    def run_job(self, job, run_id=None) -> dict:
+        """
+        Run a job to completion.
+
+        :param run_id: The id of the run in the job history, passed to the crawl as JOB_RUN_ID.
+        :return: A dict with the exit "status", the crawl "stats" if known,
+            and how it was "killed" if it exceeded its budget.
+        """
+        settings = {'JOB_RUN_ID': run_id} if run_id is not None else {}
+        if self.mode == 'process' and job.mode != 'subprocess' and job.spider:
+            return self.run_in_process(job, settings)
+        return self.run_subprocess(job, settings)
+
+    def run_subprocess(self, job, settings):
+        args = shlex.split(job.name)
+        if job.spider:
+            for key, value in settings.items():
+                args += ['-s', f'{key}={value}']
+
+        # In its own process group, so that signals reach all of its processes.
+        process = subprocess.Popen(args, start_new_session=True)
+        try:
+            return {'status': process.wait(timeout=job.budget), 'stats': None, 'killed': None}
+        except subprocess.TimeoutExpired:
+            pass
+
+        print(f'Job "{job.name}" exceeded its budget of {job.budget} seconds, sending SIGTERM')
+        self.signal(process, signal.SIGTERM)
+        killed = 'SIGTERM'
+        try:
+            status = process.wait(timeout=self.kill_grace)
+        except subprocess.TimeoutExpired:
+            print(f'Job "{job.name}" did not exit {self.kill_grace} seconds after SIGTERM, sending SIGKILL')
+            self.signal(process, signal.SIGKILL)
+            killed = 'SIGKILL'
+            status = process.wait()
+        return {'status': status, 'stats': None, 'killed': killed}
 
     @staticmethod
-    def run_job(job):
-        os.system(job)
+    def signal(process, sig):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
 
-    def run_forever(self):
+    def run_in_process(self, job, settings):
+        # Imported here, since packages are only installed at startup.
+        from covidscholar_scraper.runner import CrawlTimeout, InProcessRunner
+
+        if self._runner is None:
+            self._runner = InProcessRunner()
+
+        try:
+            stats = self._runner.crawl(job.spider, settings, timeout=job.budget, grace=self.kill_grace)
+        except CrawlTimeout as e:
+            # The crawl cannot be killed in this process. The run is recorded
+            # as failed, and _run() waits for the crawl before the job can run again.
+            traceback.print_exc()
+            return {'status': 1, 'stats': None, 'killed': 'abandoned', 'abandoned': e.finished}
+        except Exception:
+            traceback.print_exc()
+            return {'status': 1, 'stats': None, 'killed': None}
+
+        if stats.get('timed_out'):
+            print(f'Job "{job.name}" exceeded its budget of {job.budget} seconds and was stopped')
+            return {'status': 1, 'stats': stats, 'killed': 'stopped'}
+        status = 0 if stats.get('finish_reason') == 'finished' else 1
+        return {'status': status, 'stats': stats, 'killed': None}
+
+    def start_job(self, job):
+        print(f'Running job "{job.name}"')
+        with self._cond:
+            self.runs.add(job)
+            job.thread = Thread(target=self._run, args=(job,), daemon=True)
+        job.thread.start()
+
+    def _run(self, job):
+        probe_result = None
+        if job.probe and not job.triggered:
+            probe_result = self.run_probe(job)
+            stale = job.last_crawl is None or time.time() - job.last_crawl > job.max_interval
+            if probe_result is not None and probe_result.get('digest') == job.probe_result.get('digest') \
+                    and not stale:
+                print(f'Probe of job "{job.name}" unchanged, skipping the crawl.')
+                with self._cond:
+                    job.thread = None
+                    self.runs.discard(job)
+                    if self.jobs.get(job.name) is job:
+                        self.schedule(job, job.probe_interval)
+                    self._cond.notify()
+                self.save_state(job)
+                return
+
+        job.last_crawl = time.time()
+        run_id = self.record_start(job)
+        self.save_state(job, last_run_start=datetime.now())
+        result = {'status': None, 'stats': None, 'killed': None}
+        try:
+            result = self.run_job(job, run_id)
+        finally:
+            print(f'Job {job.name} finished with status {result["status"]}.')
+            run = self.record_finish(job, run_id, result)
+            if result.get('abandoned') is not None:
+                # Keep the job running, so that neither a second crawl of the
+                # spider nor jobs that do not fit next to it start meanwhile.
+                print(f'Job "{job.name}" still runs in this process, waiting for it to stop.')
+                result['abandoned'].wait()
+                print(f'Abandoned run of job "{job.name}" stopped.')
+            fields = {}
+            if probe_result is not None and result['status'] == 0:
+                # Only remember the probe result once the crawl got its changes.
+                job.probe_result = fields['probe'] = probe_result
+            with self._cond:
+                job.thread = None
+                self.runs.discard(job)
+                job.adapt(run)
+                if self.jobs.get(job.name) is job:
+                    if job.triggered:
+                        job.triggered = False
+                        self.schedule(job, 0, jitter=False)
+                    else:
+                        self.schedule(job, job.next_interval)
+
+                if run.get('status') == 0 and run.get('new_items'):
+                    for dependent in list(self.jobs.values()):
+                        if job.name in dependent.after:
+                            self.trigger(dependent, f'{job.name} finished with {run["new_items"]} new items')
+                self._cond.notify()
+            self.save_state(job, last_run_end=datetime.now(), last_run_status=result['status'], **fields)
+
+    @staticmethod
+    def run_probe(job):
+        """Returns the probe result, or None if the probe failed."""
+        from covidscholar_scraper.probes import run_probe
+
+        try:
+            return run_probe(job.probe, job.probe_result)
+        except Exception:
+            traceback.print_exc()
+            return None
+
+    def trigger(self, job, reason):
+        """Run a job right away, or as soon as its current run finishes."""
+        with self._cond:
+            print(f'Job "{job.name}" triggered: {reason}')
+            if job.thread is not None:
+                job.triggered = True
+            elif job not in self.waiting:
+                self.schedule(job, 0, jitter=False)
+
+    def watch_collections(self):
+        """Trigger jobs whose watched collections got new documents. Runs in its own thread."""
+        counts = {}
         while True:
-            for name in list(self.timer):
-                self.timer[name] -= 1
+            with self._cond:
+                jobs = list(self.jobs.values())
+            for name in sorted({name for job in jobs for name in job.watch}):
+                try:
+                    count = self.db[name].estimated_document_count()
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                if name in counts and count > counts[name]:
+                    for job in jobs:
+                        if name in job.watch:
+                            self.trigger(job, f'{count - counts[name]} new documents in {name}')
+                counts[name] = count
+            time.sleep(self.watch_interval)
 
-            self.poll_jobs()
+    def record_start(self, job):
+        if self.history is None:
+            return None
+        try:
+            return self.history.start(job.name, spider=job.spider, interval=job.current_interval)
+        except Exception:
+            traceback.print_exc()
+            return None
 
-            execution = [x for x in self.timer if self.timer[x] <= 0]
-            for job in execution:
-                if self.running[job] is not None:
-                    print(f'Job {job} already running, skipping execution')
-                else:
-                    print(f'Running job "{job}"')
-                    t = Thread(target=self.run_job, args=(job,))
-                    t.start()
-                    self.running[job] = t
+    def record_finish(self, job, run_id, result) -> dict:
+        """Record the end of a run. Returns the run record, or what is known about the run without history."""
+        run = None
+        if run_id is not None:
+            try:
+                run = self.history.finish(run_id, result['status'], killed=result.get('killed'))
+            except Exception:
+                traceback.print_exc()
+
+        if run is None:
+            stats = result.get('stats')
+            new_items = None
+            if stats is not None:
+                new_items = sum(stats.get(x, 0) for x in ('telemetry/articles_saved', 'telemetry/new_versions'))
+            run = {'status': result['status'], 'new_items': new_items}
+        return run
+
+    def run_forever(self):
+        if self.db is not None and any(job.watch for job in self.jobs.values()):
+            Thread(target=self.watch_collections, daemon=True).start()
 
-                self.reset_job(job)
+        with self._cond:
+            while True:
+                self.start_waiting()
 
-            time.sleep(1)
+                job, wait = self.next_due()
+                if job is None:
+                    self._cond.wait(wait)
+                elif self.fits(job):
+                    self.start_job(job)
+                else:
+                    print(f'Job "{job.name}" ({job.cost}) queued until resources are available')
+                    self.waiting.append(job)
 
 
 if __name__ == '__main__':
+    if '--update-wheelhouse' in sys.argv:
+        update_wheelhouse()
+        exit(0)
+
     install_pip()
+    if '--install-only' in sys.argv:
+        exit(0)
 
-    Scheduler(jobs_registry).run_forever()
+    Scheduler(jobs_registry, history=load_job_history(), state=load_job_state(), db=load_database()).run_forever()
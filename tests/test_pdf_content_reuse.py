@@ -0,0 +1,75 @@
+import pytest
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer
+
+from covidscholar_scraper.db import PDFContentIndex
+from covidscholar_scraper.spiders.osf_org import OsfOrgSpider
+from covidscholar_scraper.spiders.psyarxiv import PsyarxivSpider
+
+mongomock = pytest.importorskip('mongomock')
+
+
+class FakeGridFS(object):
+    """The part of gridfs.GridFS used by BaseSpider, on a mongomock database."""
+
+    def __init__(self, db, collection):
+        self._GridFS__collection = db[collection]
+        self._GridFS__files = db[collection + '.files']
+        self.contents = {}
+
+    def put(self, data, **kwargs):
+        file_id = self._GridFS__files.insert_one(dict(kwargs, length=len(data))).inserted_id
+        self.contents[file_id] = data
+        return file_id
+
+
+def make_spider(cls, db):
+    spider = cls.from_crawler(get_crawler(cls, {'PDF_EXTRACTION_MODE': 'inline'}))
+    spider.db = db
+    spider.gridfs = {name: FakeGridFS(db, name) for name in spider.gridfs_config}
+    spider.pdf_content_index = PDFContentIndex(db['Scraper_pdf_content'])
+    spider.parsed = []
+
+    def parse_pdf(pdf_data, filename):
+        spider.parsed.append(filename)
+        return defer.succeed({
+            'pdf_extraction_status': 'done',
+            'pdf_extraction_success': True,
+            'pdf_extraction_plist': [{'name': '', 'content': ['Text']}],
+            'pdf_extraction_exec': None,
+            'pdf_extraction_version': spider.pdf_parser_version,
+            'pdf_extractor_version': 'test',
+            'parsed_date': None,
+        })
+
+    spider.parse_pdf = parse_pdf
+    return spider
+
+
+def saved_file_id(d):
+    results = []
+    d.addCallback(results.append)
+    return results[0]
+
+
+def test_psyarxiv_pdf_is_reused_by_osf_org():
+    db = mongomock.MongoClient().db
+    psyarxiv = make_spider(PsyarxivSpider, db)
+    osf_org = make_spider(OsfOrgSpider, db)
+    assert psyarxiv.pdf_parser_version != osf_org.pdf_parser_version
+
+    pdf = b'%PDF-1.4 same preprint'
+    psyarxiv_bucket, = psyarxiv.gridfs_config
+    osf_bucket, = osf_org.gridfs_config
+    psyarxiv_id = saved_file_id(psyarxiv.save_pdf(pdf, 'a.pdf', 'https://psyarxiv.com/a', psyarxiv_bucket))
+    osf_id = saved_file_id(osf_org.save_pdf(pdf, 'b.pdf', 'https://osf.io/b', osf_bucket))
+
+    assert psyarxiv.parsed == ['a.pdf']
+    assert osf_org.parsed == []
+
+    osf_file = db[osf_bucket + '.files'].find_one({'_id': osf_id})
+    assert osf_file['content_bucket'] == psyarxiv_bucket
+    assert osf_file['content_file_id'] == psyarxiv_id
+    assert osf_file['pdf_extraction_plist'] == [{'name': '', 'content': ['Text']}]
+    assert osf_file['pdf_extraction_version'] == 'preprints_org_20200727'
+    assert osf_org.gridfs[osf_bucket].contents[osf_id] == b''